@@ -1,7 +1,9 @@
 import numpy as np
 import os
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from itertools import product
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
 from pymclevel import BoundingBox, Entity, TileEntity
 
 
@@ -70,7 +72,7 @@ from pymclevel import BoundingBox, Entity, TileEntity
 
 
 # Version of 'br.py'. Follows semantic versioning.
-VERSION = "2.2.0"
+VERSION = "2.11.0"
 
 
 # Checks that the current 'br.py' version matches the given `major`, and at-least
@@ -949,22 +951,34 @@ def selector(name, spec):
     return sel
 
 
+# Number of possible block ids (12 bits) and datas (4 bits).
+ID_COUNT = 4096
+DATA_COUNT = 16
+
 class Sel:
     def __init__(self, expr):
-        self._top = expr
+        # Evaluate the expression once for every possible block, giving a lookup
+        # table of which (bid, bdata) pairs match. This way matching a chunk is a
+        # single index, no matter how complex the selector is (instead of walking
+        # the expression tree and creating a temporary array at every node).
+        ids, datas = np.indices((ID_COUNT, DATA_COUNT))
+        self._table = np.empty((ID_COUNT, DATA_COUNT), dtype=bool)
+        self._table[:] = expr.do(ids, datas) # may be a scalar (i.e. "1=1").
+        # Only need the expression for printing.
+        self._repr = repr(expr)
 
     def matches(self, ids, datas):
-        return self._top.do(ids, datas)
+        return self._table[ids, datas]
 
     def mask(self, level, box):
         mask = np.empty(shape(box), dtype=bool)
         # Find the masks for the whole selection.
-        for ids, datas, slices in iterate(level, box, BLOCKS):
+        for ids, datas, slices in iterate(level, box, BLOCKS, readonly=True):
             mask[slices] = self.matches(ids, datas)
         return mask
 
     def __repr__(self):
-        return repr(self._top)
+        return self._repr
 
 
 
@@ -1176,10 +1190,44 @@ TES = 3
 ENTITIES = 4
 
 
+# Tallies the changes made to a level by a filter. Only chunks that actually
+# changed are dirtied, see `iterate`.
+class Changes:
+    def __init__(self):
+        self.blocks = 0
+        self._chunks = set()
+
+    # Number of chunks changed.
+    @property
+    def chunks(self):
+        return len(self._chunks)
+
+    # Adds the changes of a chunk, where `changed` is a boolean array of which of
+    # its blocks were modified. The chunk is only dirtied if there were any.
+    def tally(self, chunk, changed):
+        count = np.count_nonzero(changed)
+        if count == 0:
+            return
+        chunk.chunkChanged(calcLighting=True)
+        self._chunks.add(chunk.chunkPosition)
+        self.blocks += count
+
+    def __repr__(self):
+        return "{} block{} across {} chunk{}".format(self.blocks,
+                plural(self.blocks), self.chunks, plural(self.chunks))
+
+
 # Iterates through the selection of the level. The `method` argument determines
 # the format of the yielded values. If `holey` is true, missing chunks will be
-# skipped instead of throwing.
-def iterate(level, box, method, holey=False):
+# skipped instead of throwing. If `readonly` is true, the chunks are never marked
+# as changed by this function, so mcedit won't relight or resave them (the
+# yielded values must not be modified in this case). If `changes` is a
+# `Changes` object (only valid for `BLOCKS`), the chunks are instead only marked
+# as changed if their blocks were actually modified, and these modifications are
+# tallied into it.
+def iterate(level, box, method, holey=False, readonly=False, changes=None):
+    assert (changes is None) or (method == BLOCKS and not readonly)
+
     # fucking finally found the culprit of the chunk skipping bug. i believe the
     # chunks were being unloaded before the changes could be made/saved/
     # something. idk exactly why this was happening, but keeping a reference in
@@ -1194,8 +1242,11 @@ def iterate(level, box, method, holey=False):
     # least related to unloading).
     for chunk, slices, point in level.getChunkSlices(box):
         # Set to dirty also with lighting recalculation, since we don't know if
-        # the filter is going to affect lighting so just assume it do.
-        chunk.chunkChanged(calcLighting=True)
+        # the filter is going to affect lighting so just assume it do. Unless
+        # it's read-only ofc, then there's nothing to save. Or we're tracking
+        # the changes, then it gets dirtied later only if it changed.
+        if not readonly and changes is None:
+            chunk.chunkChanged(calcLighting=True)
         chunks.append(chunk)
 
 
@@ -1237,15 +1288,28 @@ def iterate(level, box, method, holey=False):
 
 
         # Get the current slice of the box.
-        pos = [point[i] for i in (0,2,1)]
-        size = [s.stop - s.start for s in slices]
-        sel_slices = tuple(slice(p, p + s) for p, s in zip(pos, size))
+        sel_slices = selection_slices(slices, point)
 
 
         # Blocks pretty easy.
         if method == BLOCKS:
             # Jus gotta index.
-            yield chunk.Blocks[slices], chunk.Data[slices], sel_slices
+            ids = chunk.Blocks[slices]
+            datas = chunk.Data[slices]
+
+            # If tracking changes, need to remember what the blocks were before
+            # the filter got its hands on them.
+            if changes is not None:
+                old_ids = np.copy(ids)
+                old_datas = np.copy(datas)
+
+            try:
+                yield ids, datas, sel_slices
+            finally:
+                # Compare once the filter is done with this chunk (also if the
+                # filter stopped iterating early).
+                if changes is not None:
+                    changes.tally(chunk, (ids != old_ids) | (datas != old_datas))
             continue
 
 
@@ -1270,6 +1334,63 @@ def iterate(level, box, method, holey=False):
 
 
 
+# Returns the slices of an array of shape `br.shape(box)` which line up with a
+# chunk's `slices` and `point`, as returned by `getChunkSlices(box)`.
+def selection_slices(slices, point):
+    pos = [point[i] for i in (0,2,1)]
+    size = [s.stop - s.start for s in slices]
+    return tuple(slice(p, p + s) for p, s in zip(pos, size))
+
+
+
+# Returns a tuple of `ids, datas`, where each is a contiguous xzy array of the
+# block ids/datas of the entire box. If `holey` is true, missing chunks are read
+# as air instead of throwing. No chunks are marked as changed. `out` allows
+# preallocated `ids, datas` arrays to be used (which are not zeroed).
+def read_box(level, box, holey=False, out=None):
+    if out is None:
+        ids = np.zeros(shape(box), dtype=np.uint16)
+        datas = np.zeros(shape(box), dtype=np.uint8)
+    else:
+        ids, datas = out
+    for cur_ids, cur_datas, slices in iterate(level, box, BLOCKS, holey=holey,
+            readonly=True):
+        ids[slices] = cur_ids
+        datas[slices] = cur_datas
+    return ids, datas
+
+
+# Writes the xzy `ids` and `datas` arrays (of shape `br.shape(box)`) back to the
+# box. Only the blocks which differ from the level are touched, and only the
+# chunks which have such a block are marked as changed. If `mask` is given, only
+# the blocks where it is true are written. The changes are tallied into
+# `changes`, if given. `holey` is the same as for `iterate`.
+def write_box(level, box, ids, datas, mask=None, changes=None, holey=False):
+    # Still need something to do the dirtying.
+    if changes is None:
+        changes = Changes()
+
+    for chunk, slices, point in iterate(level, box, DEFAULT, holey=holey,
+            readonly=True):
+        sel_slices = selection_slices(slices, point)
+        cur_ids = chunk.Blocks[slices]
+        cur_datas = chunk.Data[slices]
+        new_ids = ids[sel_slices]
+        new_datas = datas[sel_slices]
+
+        # Find the blocks that are actually getting changed.
+        changed = (cur_ids != new_ids)
+        changed |= (cur_datas != new_datas)
+        if mask is not None:
+            changed &= mask[sel_slices]
+
+        # Set em.
+        cur_ids[changed] = new_ids[changed]
+        cur_datas[changed] = new_datas[changed]
+        changes.tally(chunk, changed)
+
+
+
 # Shifts the values of an array along an axis. Fills any now-empty values with 0
 # if not clamping, otherwise fills it with the first perpendicular slice of the
 # array along the shifted axis. `out` allows preallocated memory to be used,
@@ -1374,6 +1495,23 @@ def unique_blocks(ids, datas):
 
 
 
+# Returns the slices of the smallest box containing every true element of
+# `mask`, expanded by `by` in every direction (but kept within the array).
+# Returns none if there are no true elements.
+def bounding_slices(mask, by=0):
+    slices = []
+    for axis in range(mask.ndim):
+        others = tuple(a for a in range(mask.ndim) if a != axis)
+        hits = np.flatnonzero(np.any(mask, axis=others))
+        if len(hits) == 0:
+            return None
+        start = max(hits[0] - by, 0)
+        end = min(hits[-1] + 1 + by, mask.shape[axis])
+        slices.append(slice(start, end))
+    return tuple(slices)
+
+
+
 # Returns the shape of the box, in x,z,y order.
 def shape(box):
     # Cheeky unpack, reorder and repack.
@@ -1421,3 +1559,456 @@ def esc(string):
 # Returns "s" if `n` is not 1, otherwise an empty string.
 def plural(n):
     return "s" if (n != 1) else ""
+
+
+
+
+# ============================================================================= #
+# == TILING =================================================================== #
+# ============================================================================= #
+
+
+# Rough cap on the memory (in bytes) used by each tile in `tiled`. Lower this if
+# mcedit runs out of memory, raise it if there's memory to spare (bigger tiles
+# waste less time on their halos).
+MEMORY_BUDGET = 512 * 2**20
+
+# Smallest tile length `tiled` will use, regardless of the budget.
+MIN_TILE = 16
+
+# Most blocks (as a multiple of the box's volume) that the tiles of `tiled` may
+# read in total, halos included. Any smaller tiles would spend most of their
+# time on their halos, so they're left over the budget instead.
+MAX_OVERREAD = 4
+
+# Number of processes `tiled` runs the kernels in. Set above 1 to use more cores
+# (note the memory budget is then per-process). Only supported where processes
+# can be forked (so not windows). The blocks produced are only the same as with
+# one process for kernels which don't use randomness, since each process is
+# reseeded for every tile. Only filters which run through `tiled` use this, which
+# is smooth, coat, drip and seamless noise (non-seamless stuartian noise is made
+# all at once, so it can't be split up).
+WORKERS = 1
+
+
+# Runs `kernel` over the box in tiles instead of all at once, so that the memory
+# used is capped by a budget instead of growing with the size of the box. The
+# blocks produced are exactly the same as running the kernel over the entire box
+# at once, provided the kernel's result for any block only depends on the blocks
+# within `halo` of it (and it doesn't use randomness, which is drawn per tile).
+# - `kernel(ids, datas, pad, tile, *args)` is called for each tile. `ids, datas`
+#       are xzy arrays of the blocks in `pad`, which is `tile` expanded by the
+#       halo (but clipped to `bounds`). The kernel should modify `ids, datas`
+#       in-place, only the modifications within `tile` are kept.
+# - `halo` is the reach of the kernel, either an int or a tuple in xzy order.
+# - `bounds` is the box the kernel may see the blocks of, defaults to `box`.
+# - `cost` is roughly how many bytes the kernel uses per block.
+# - `budget` is the memory cap, defaults to `MEMORY_BUDGET`.
+# - `axes` are the axes which may be split into tiles.
+# - `mask` and `changes` are the same as for `write_box`.
+# - `holey` is the same as for `read_box`/`write_box`, so missing chunks are read
+#       as air and never written.
+# - `workers` is the number of processes to use, defaults to `WORKERS`. If more
+#       than one, `kernel` and `args` must be picklable (so the kernel must be
+#       a top-level function).
+def tiled(level, box, kernel, args=(), halo=0, bounds=None, cost=1,
+        budget=None, axes=(AXIS_X, AXIS_Z), mask=None, changes=None,
+        workers=None, holey=False):
+    if isinstance(halo, int):
+        halo = (halo,) * 3
+    if bounds is None:
+        bounds = box
+    if budget is None:
+        budget = MEMORY_BUDGET
+    if workers is None:
+        workers = WORKERS
+
+    tiles, last_readers = tile_grid(box, halo, bounds, cost, budget, axes)
+    pads = [pad_tile(tile, halo, bounds) for tile in tiles]
+
+    # Get the kernel results of every tile, in order.
+    if workers > 1 and os.name != "posix":
+        print "Cannot use multiple processes on this platform, using one."
+        workers = 1
+    if workers > 1 and len(tiles) > 1:
+        results = run_tiles_parallel(level, kernel, args, tiles, pads, workers,
+                holey)
+    else:
+        results = run_tiles(level, kernel, args, tiles, pads, holey)
+
+    # Each tile reads its halo from the level, so a tile's result can't be
+    # written until every tile which reads its blocks has been read (otherwise
+    # they'd see the new blocks instead of the originals). So, hold onto results
+    # until it's safe.
+    pending = deque()
+
+    def write(tile, ids, datas):
+        tile_mask = None if (mask is None) else mask[submask(box, tile)]
+        write_box(level, tile, ids, datas, mask=tile_mask, changes=changes,
+                holey=holey)
+
+    for i, (tile, ids, datas) in enumerate(results):
+        pending.append((last_readers[i], tile, ids, datas))
+
+        # Write the results which are now safe (note every tile is always read
+        # before its result is given).
+        while pending and pending[0][0] <= i:
+            write(*pending.popleft()[1:])
+
+    # Everything's been read by now.
+    while pending:
+        write(*pending.popleft()[1:])
+
+
+# Returns a tuple of `tiles, last_readers`. `tiles` is a list of the tiles to
+# split `box` into (for `tiled`), and `last_readers` is the index of the last
+# tile which reads the blocks of each tile.
+def tile_grid(box, halo, bounds, cost, budget, axes):
+    dims = shape(box)
+    starts = [box.origin[i] for i in (0,2,1)]
+    bounds_starts = [bounds.origin[i] for i in (0,2,1)]
+    bounds_ends = [p + n for p, n in zip(bounds_starts, shape(bounds))]
+
+    # Lengths along the axis of every padded tile, when split into tiles of the
+    # given length (clipped to the bounds, same as `pad_tile`).
+    def padded(axis, length):
+        if axis not in axes:
+            length = dims[axis]
+        lengths = []
+        for start in range(starts[axis], starts[axis] + dims[axis], length):
+            end = min(start + length, starts[axis] + dims[axis])
+            lengths.append(min(end + halo[axis], bounds_ends[axis])
+                    - max(start - halo[axis], bounds_starts[axis]))
+        return lengths
+
+    # Volume of the largest padded tile, and of every padded tile in total.
+    def volume(length):
+        return np.prod([max(padded(axis, length)) for axis in AXES])
+    def total(length):
+        return np.prod([sum(padded(axis, length)) for axis in AXES])
+
+    # Find the largest tile length which fits in the budget, halving from a
+    # single tile. Stop once the tiles stop getting smaller or they'd read too
+    # much more than the box, since smaller tiles are then mostly halo (and
+    # there's no point going much below the halo for the same reason).
+    smallest = max([MIN_TILE] + [halo[axis] for axis in axes])
+    length = max([dims[axis] for axis in axes] + [1])
+    while length > smallest and volume(length) * cost > budget:
+        smaller = max(smallest, (length + 1) // 2)
+        if volume(smaller) >= volume(length):
+            break
+        if total(smaller) > MAX_OVERREAD * np.prod(dims):
+            break
+        length = smaller
+    if volume(length) * cost > budget:
+        print ("The halo is too large to split the selection into tiles within "
+                "the memory budget, using larger tiles.")
+
+    # Number of tiles along each axis, and how many tiles along each axis a
+    # tile's halo reaches into.
+    counts = [1] * 3
+    reach = [0] * 3
+    for axis in axes:
+        counts[axis] = (dims[axis] + length - 1) // length
+        reach[axis] = (halo[axis] + length - 1) // length
+
+    # Split the box.
+    tiles = []
+    last_readers = []
+    for index in product(*map(range, counts)):
+        # Get the xzy origin and size of this tile.
+        origin = []
+        size = []
+        for axis in AXES:
+            if counts[axis] == 1:
+                origin.append(0)
+                size.append(dims[axis])
+            else:
+                start = index[axis] * length
+                origin.append(start)
+                size.append(min(length, dims[axis] - start))
+
+        # Convert to an xyz box.
+        origin = [p + origin[i] for p, i in zip(box.origin, (0,2,1))]
+        size = [size[i] for i in (0,2,1)]
+        tiles.append(BoundingBox(origin, size))
+
+        # The last tile which reads this one (in the order of `product`) is the
+        # furthest one whose halo can reach it.
+        last = [min(i + r, c - 1) for i, r, c in zip(index, reach, counts)]
+        last_readers.append(np.ravel_multi_index(last, counts))
+
+    return tiles, last_readers
+
+
+# Returns the box the kernel sees for the given tile, for `tiled`.
+def pad_tile(tile, halo, bounds):
+    hx, hz, hy = halo
+    return tile.expand(hx, hy, hz).intersect(bounds)
+
+
+# Yields `tile, ids, datas` for every tile, where `ids, datas` are the blocks
+# within the tile after running the kernel (for `tiled`).
+def run_tiles(level, kernel, args, tiles, pads, holey=False):
+    for tile, pad in zip(tiles, pads):
+        ids, datas = read_box(level, pad, holey=holey)
+        kernel(ids, datas, pad, tile, *args)
+
+        # Only keep the tile itself.
+        sub = submask(pad, tile)
+        yield tile, np.copy(ids[sub]), np.copy(datas[sub])
+
+
+# Same as `run_tiles`, except the kernels are ran in a pool of `workers`
+# processes. The blocks are passed to/from the processes through shared memory,
+# and this process reads the next batch of tiles while the current batch is
+# being processed.
+def run_tiles_parallel(level, kernel, args, tiles, pads, workers, holey=False):
+    # Two slots of shared memory for every worker, one for the batch being
+    # processed and one for the batch being read.
+    size = max(np.prod(shape(pad)) for pad in pads)
+    slots = [(RawArray("H", size), RawArray("B", size))
+            for _ in range(2 * workers)]
+
+    # Reads the tiles into their slots and sends them off.
+    def submit(batch, first_slot):
+        tasks = []
+        for slot, i in enumerate(batch, first_slot):
+            out = slot_arrays(slots[slot], shape(pads[i]))
+            # Missing chunks aren't read, so clear out the last tile.
+            if holey:
+                for array in out:
+                    array[:] = 0
+            read_box(level, pads[i], holey=holey, out=out)
+            # Every process would otherwise have the same random state.
+            seed = np.random.randint(2**31)
+            tasks.append((slot, box_tuple(pads[i]), box_tuple(tiles[i]),
+                    kernel, args, seed))
+        return pool.map_async(tile_worker, tasks)
+
+    # Waits for the tiles to be processed and gets their results.
+    def collect(batch, first_slot, result):
+        result.get()
+        for slot, i in enumerate(batch, first_slot):
+            ids, datas = slot_arrays(slots[slot], shape(pads[i]))
+            sub = submask(pads[i], tiles[i])
+            yield tiles[i], np.copy(ids[sub]), np.copy(datas[sub])
+
+    pool = Pool(workers, initializer=tile_worker_init, initargs=(slots,))
+    try:
+        batches = [range(i, min(i + workers, len(tiles)))
+                for i in range(0, len(tiles), workers)]
+        previous = None
+        for b, batch in enumerate(batches):
+            # Alternate between the two halves of the slots.
+            current = (batch, (b % 2) * workers)
+            current += (submit(*current),)
+            if previous is not None:
+                for result in collect(*previous):
+                    yield result
+            previous = current
+        for result in collect(*previous):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Shared memory slots of a tile worker process.
+WORKER_SLOTS = None
+
+def tile_worker_init(slots):
+    global WORKER_SLOTS
+    WORKER_SLOTS = slots
+
+# Runs the kernel on a tile in a worker process, see `run_tiles_parallel`.
+def tile_worker(task):
+    slot, pad, tile, kernel, args, seed = task
+    pad = BoundingBox(*pad)
+    tile = BoundingBox(*tile)
+    np.random.seed(seed)
+    ids, datas = slot_arrays(WORKER_SLOTS[slot], shape(pad))
+    kernel(ids, datas, pad, tile, *args)
+
+
+# Returns `ids, datas` arrays of the given shape, using the memory of a shared
+# memory slot.
+def slot_arrays(slot, shape):
+    count = np.prod(shape)
+    ids = np.frombuffer(slot[0], dtype=np.uint16, count=count)
+    datas = np.frombuffer(slot[1], dtype=np.uint8, count=count)
+    return ids.reshape(shape), datas.reshape(shape)
+
+
+# Returns the box as a picklable tuple of `origin, size`.
+def box_tuple(box):
+    return tuple(box.origin), tuple(box.size)
+
+
+
+
+# ============================================================================= #
+# == CACHING ================================================================== #
+# ============================================================================= #
+
+
+# Default cap on the memory (in bytes) of the arrays held by each cache.
+CACHE_BUDGET = 256 * 2**20
+
+# Every named cache, see `cache`. Lives in here so that the caches outlive the
+# filters using them (mcedit reloads filters, but not 'br.py').
+CACHES = {}
+
+
+# Returns the cache with the given name, creating it if needed (with the given
+# `budget`, defaulting to `CACHE_BUDGET`).
+def cache(name, budget=None):
+    if name not in CACHES:
+        CACHES[name] = Cache(CACHE_BUDGET if (budget is None) else budget)
+    return CACHES[name]
+
+
+# Holds numpy arrays by key, dropping the least recently used arrays once their
+# total size goes over the `budget` (in bytes). The arrays are shared, so they
+# must not be modified after being put in or gotten out.
+class Cache:
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self._arrays = OrderedDict()
+
+    # Returns the array of the key, or none if it isn't cached.
+    def get(self, key):
+        array = self._arrays.pop(key, None)
+        if array is not None:
+            # Now the most recently used.
+            self._arrays[key] = array
+        return array
+
+    # Caches the array under the key. Arrays larger than the entire budget are
+    # just not cached.
+    def put(self, key, array):
+        old = self._arrays.pop(key, None)
+        if old is not None:
+            self.size -= old.nbytes
+        if array.nbytes > self.budget:
+            return
+        self._arrays[key] = array
+        self.size += array.nbytes
+
+        # Drop the least recently used, until it fits.
+        while self.size > self.budget:
+            _, dropped = self._arrays.popitem(last=False)
+            self.size -= dropped.nbytes
+
+    # Drops every cached array.
+    def clear(self):
+        self._arrays.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __repr__(self):
+        return "{} array{} ({} bytes)".format(len(self), plural(len(self)),
+                self.size)
+
+
+
+
+# ============================================================================= #
+# == PACKED MASKS ============================================================= #
+# ============================================================================= #
+
+
+# A boolean xzy array which is packed 8 elements to a byte along the y axis (so
+# the y axis is `ceil(y / 8)` bytes long). This makes whole-array logic and
+# shifting move 8 times less memory than the typical bool arrays. Any padding
+# bits at the end of y are always kept as false.
+class BitMask:
+    def __init__(self, shape, bits=None):
+        self.shape = tuple(shape)
+        if bits is None:
+            bits = np.zeros(self.shape[:2] + ((self.shape[2] + 7) // 8,),
+                    dtype=np.uint8)
+        self.bits = bits
+
+    # Returns the packed version of the given bool array.
+    @classmethod
+    def pack(cls, mask):
+        return cls(mask.shape, np.packbits(mask, axis=AXIS_Y))
+
+    # Returns the bool array of this mask.
+    def unpack(self):
+        mask = np.unpackbits(self.bits, axis=AXIS_Y)
+        return mask[..., :self.shape[2]].astype(bool)
+
+    def copy(self):
+        return BitMask(self.shape, np.copy(self.bits))
+
+    # Returns true if any element is set.
+    def any(self):
+        return self.bits.any()
+
+    # Same as the global `shift` (without clamping), but for the packed mask.
+    def shift(self, by, axis, out=None):
+        if out is None:
+            out = BitMask(self.shape)
+
+        # The x and z axes are still one byte per element, so just shift them.
+        if axis != AXIS_Y:
+            shift(self.bits, by, axis, out=out.bits)
+            return out
+
+        # Otherwise it's a shift by whole bytes, then by the remaining bits
+        # (carrying the bits that cross into the neighbouring byte). Elements
+        # are packed starting at the most significant bit, so forwards in y is
+        # a right shift.
+        sign = 1 if (by > 0) else -1
+        shift(self.bits, sign * (abs(by) // 8), AXIS_Y, out=out.bits)
+        bits = abs(by) % 8
+        if bits:
+            carry = shift(out.bits, sign, AXIS_Y)
+            if by > 0:
+                out.bits >>= bits
+                carry <<= 8 - bits
+            else:
+                out.bits <<= bits
+                carry >>= 8 - bits
+            out.bits |= carry
+
+        # Clear any bits that were shifted into the padding.
+        if by > 0:
+            out._clear_padding()
+        return out
+
+    # Same as the global `shift_xzy`, but for the packed mask.
+    def shift_xzy(self, x_by, z_by, y_by, out=None):
+        out = self.shift(x_by, AXIS_X, out=out)
+        out = out.shift(z_by, AXIS_Z, out=out)
+        out = out.shift(y_by, AXIS_Y, out=out)
+        return out
+
+    def _clear_padding(self):
+        padding = -self.shape[2] % 8
+        if padding:
+            self.bits[..., -1] &= (0xFF << padding) & 0xFF
+
+    def __iand__(self, other):
+        self.bits &= other.bits
+        return self
+
+    def __ior__(self, other):
+        self.bits |= other.bits
+        return self
+
+    def __and__(self, other):
+        return BitMask(self.shape, self.bits & other.bits)
+
+    def __or__(self, other):
+        return BitMask(self.shape, self.bits | other.bits)
+
+    def __invert__(self):
+        inverted = BitMask(self.shape, ~self.bits)
+        inverted._clear_padding()
+        return inverted
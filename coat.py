@@ -9,7 +9,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 10)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -24,65 +24,159 @@ inputs = (
             "blocks, replaces them with 'block'. 'expand into' dictates which "
             "directions it may expand, and each option includes the ones above.",
             "label"),
+    ("Blocks 2 to 4 are layered on top of 'block', each coating the next "
+            "'depth' blocks further out. A depth of 0 skips that layer. If "
+            "block id 256 is used as a block, that layer is left unchanged "
+            "instead.",
+            "label"),
     ("Find:", "string"),
     ("Replace:", "string"),
     ("Block:", alphaMaterials.Stone),
     ("Depth:", (1, 1, 256)),
+    ("Block 2:", alphaMaterials.Air),
+    ("Block 2 depth:", (0, 0, 256)),
+    ("Block 3:", alphaMaterials.Air),
+    ("Block 3 depth:", (0, 0, 256)),
+    ("Block 4:", alphaMaterials.Air),
+    ("Block 4 depth:", (0, 0, 256)),
     ("Expand to:", ("faces", "edges", "corners")),
     br.selector_explain("find", "replace"),
 )
 
 
 def perform(level, box, options):
-    depth = options["Depth:"]
     expand_to = options["Expand to:"]
 
     find = br.selector("find", options["Find:"])
     replace = br.selector("replace", options["Replace:"])
-    bid, bdata = options["Block:"].ID, options["Block:"].blockData
-
 
-    # Get the find and replace masks for the selection.
-    find_mask = find.mask(level, box)
-    replace_mask = replace.mask(level, box)
+    names = ["Block:"] + ["Block {}:".format(i) for i in (2,3,4)]
+    blocks = [(options[name].ID, options[name].blockData) for name in names]
+    depths = [options["Depth:"]]
+    depths += [options["Block {} depth:".format(i)] for i in (2,3,4)]
+    depth = sum(depths)
 
-    # Get every matched block.
-    mask = coat(find_mask, replace_mask, depth, expand_to)
+    # Make a lookup of the block to place at each distance of the coat, so that
+    # every layer can be placed from the one distance field.
+    layers = np.repeat(np.arange(len(blocks)), depths)
+    layer_ids = np.array([bid for bid, _ in blocks], dtype=np.uint16)
+    layer_datas = np.array([bdata for _, bdata in blocks], dtype=np.uint8)
+    bids = np.concatenate(([0], layer_ids[layers]))
+    bdatas = np.concatenate(([0], layer_datas[layers]))
 
-    # Place the blocks.
-    for ids, datas, slices in br.iterate(level, box, br.BLOCKS):
-        cur_mask = mask[slices]
 
-        # Set the blocks.
-        ids[cur_mask] = bid
-        datas[cur_mask] = bdata
+    # Coat in tiles, so that huge selections don't run out of memory. Each tile
+    # needs to see `depth` blocks around it, since that's how far a coat can
+    # reach. Though it never needs to see further than the selection (which is
+    # all it can see anyway), so cap it to keep a huge layered depth from
+    # inflating the tiles.
+    halo = tuple(min(depth, n) for n in br.shape(box))
+    changes = br.Changes()
+    br.tiled(level, box, coat_tile, args=(find, replace, depth, expand_to, bids,
+            bdatas), halo=halo, cost=TILE_COST, changes=changes)
 
 
     print "Finished coating."
     print "- find: {}".format(find)
     print "- replace: {}".format(replace)
-    print "- block: ({}:{})".format(bid, bdata)
-    print "- depth: {}".format(depth)
+    for i, ((bid, bdata), bdepth) in enumerate(zip(blocks, depths)):
+        if bdepth == 0:
+            continue
+        name = "block" if i == 0 else "block {}".format(i + 1)
+        if bid != 256:
+            print "- {}: ({}:{})".format(name, bid, bdata)
+        else:
+            print "- {}: unchanged".format(name)
+        print "- {} depth: {}".format(name, bdepth)
     print "- expand to: {}".format(expand_to)
+    print "- changed: {}".format(changes)
     return
 
 
 
+# Rough bytes used per block by `coat_tile`.
+TILE_COST = 24
+
+# Largest fraction of the blocks which can be on the frontier of a coat before
+# it's quicker to just expand every block at once.
+SPARSE_LIMIT = 0.02
+
+# Coats the blocks of a tile, see `br.tiled`. `bids` and `bdatas` are the block
+# to place at each distance of the coat.
+def coat_tile(ids, datas, pad, tile, find, replace, depth, expand_to, bids,
+        bdatas):
+    # Get the find and replace masks for the tile.
+    find_mask = find.matches(ids, datas)
+    replace_mask = replace.matches(ids, datas)
+
+    # Get how far into the coat every matched block is.
+    dists = coat(find_mask, replace_mask, depth, expand_to)
+
+    # Place the blocks of every layer at once. id 256 means skip block.
+    mask = (dists > 0)
+    mask[mask] = (bids[dists[mask]] != 256)
+    ids[mask] = bids[dists[mask]]
+    datas[mask] = bdatas[dists[mask]]
+
+
+# Returns the distance field of the coat, which is the number of expansions it
+# took to reach each block (so, 1 to `depth` within the coat and 0 outside it).
+# This is a breadth-first search from every find block at once, which can only
+# travel through replace blocks and only to the adjacents of `expand_to`. Each
+# expansion only works from the blocks the last one added, so the search costs
+# about what the coated blocks do. Note the tiles it runs over still grow with
+# `depth` though, since each needs a halo that deep (see `perform`).
 def coat(find_mask, replace_mask, depth, expand_to):
-    # Preallocate some memory for shifting.
-    shifted = np.empty_like(find_mask)
-    unshifted = np.empty_like(find_mask)
+    # Pad the masks by a block of nothing on every side, so that every block has
+    # all its adjacents (as flat indices) without wrapping.
+    inside = (slice(1, -1),) * 3
+    padded = tuple(n + 2 for n in find_mask.shape)
+    replace_padded = np.zeros(padded, dtype=bool)
+    replace_padded[inside] = replace_mask
 
-    # Expand the mask `depth` times. Note the original find matches are there
-    # only as a seed and will be removed after the coating.
-    mask = np.copy(find_mask)
-    for _ in range(depth):
-        expand(mask, replace_mask, shifted, unshifted, expand_to)
+    # Packed replace mask for the dense expansions, only made if needed.
+    replace_bits = None
 
-    # Remove the find matches which were added only to seed.
-    mask[find_mask] = False
+    # Get the flat offsets to each adjacent we expand to.
+    strides = (padded[1] * padded[2], padded[2], 1)
+    offsets = np.array([np.dot(adj, strides) for adj in adjacents(expand_to)])
 
-    return mask
+    # Expand the mask `depth` times. Note the original find matches are there
+    # only as a seed and aren't given a distance.
+    mask = np.zeros(padded, dtype=bool)
+    mask[inside] = find_mask
+    flat_mask = mask.reshape(-1)
+    flat_replace = replace_padded.reshape(-1)
+    dists = np.zeros(padded, dtype=np.uint16)
+    flat_dists = dists.reshape(-1)
+
+    # Only the blocks added in the last expansion (the frontier) can add any new
+    # blocks, so only expand from them. Stop once nothing's being added.
+    frontier = np.flatnonzero(mask)
+    for step in range(1, depth + 1):
+        if len(frontier) == 0:
+            break
+
+        if len(frontier) > SPARSE_LIMIT * mask.size:
+            # When the frontier's big, it's quicker to just expand everything
+            # (in packed form, since it moves so much less memory).
+            if replace_bits is None:
+                replace_bits = br.BitMask.pack(replace_padded)
+            bits = br.BitMask.pack(mask)
+            added = (expand(bits, replace_bits, expand_to) & ~bits).unpack()
+            frontier = np.flatnonzero(added)
+            mask |= added
+        else:
+            # Otherwise find every new adjacent of the frontier.
+            added = (frontier[:, None] + offsets).ravel()
+            added = added[flat_replace[added] & ~flat_mask[added]]
+            frontier = np.unique(added)
+            flat_mask[frontier] = True
+
+        # Every block on the frontier was first reached in this expansion.
+        flat_dists[frontier] = step
+
+    return dists[inside]
 
 
 
@@ -107,18 +201,43 @@ MAX_COORD_SUM = {
 # Precompute all the adjacent coord sums.
 ADJACENTS = [(pos, sum(map(abs, pos))) for pos in br.ADJACENTS]
 
-def expand(mask, replace_mask, shifted, unshifted, expand_to):
-    # `shifted` and `unshifted` are just pre-allocated arrays.
-
-    # Get a list of all the adjacent corners we will expand to.
+# Returns a list of all the adjacent corners we will expand to.
+def adjacents(expand_to):
     max_coord_sum = MAX_COORD_SUM[expand_to]
-    adjacents = [pos for pos, sumc in ADJACENTS if sumc <= max_coord_sum]
-
-    # Store the array before added the points so that we don't accidentally add
-    # unintended points by modifying `mask` within the loop.
-    unshifted[:] = mask
-
-    # Loop through and add all adjacent points.
-    for adj in adjacents:
-        br.shift_xzy(unshifted, *adj, out=shifted)
-        mask |= (shifted & replace_mask)
+    return [pos for pos, sumc in ADJACENTS if sumc <= max_coord_sum]
+
+# Returns the expanded mask, where both masks are `br.BitMask`s.
+def expand(mask, replace_mask, expand_to):
+    # Since a single expansion only checks the replace mask of the blocks it
+    # adds, it's the same as expanding without any restriction and then keeping
+    # the replace blocks. That unrestricted expansion is separable into 1d
+    # expansions along each axis (see `grow`):
+    # - corners is the whole cube, so growing along x, z then y.
+    # - edges is every 3x3 square through the middle, so the union of growing
+    #   along each pair of axes.
+    # - faces is every 1x3 line through the middle, so the union of growing
+    #   along each axis.
+    X, Z, Y = br.AXES
+    if expand_to == "corners":
+        expanded = grow(grow(grow(mask, Y), Z), X)
+    elif expand_to == "edges":
+        grown_y = grow(mask, Y)
+        expanded = grow(grown_y, Z)
+        expanded |= grow(grown_y, X)
+        expanded |= grow(grow(mask, Z), X)
+    else:
+        expanded = grow(mask, Y)
+        expanded |= grow(mask, Z)
+        expanded |= grow(mask, X)
+
+    # Keep the original mask, and only add replace blocks.
+    expanded &= replace_mask
+    expanded |= mask
+    return expanded
+
+# Returns the mask expanded by 1 in both directions along the given axis.
+def grow(mask, axis):
+    grown = mask.shift(1, axis)
+    grown |= mask
+    grown |= mask.shift(-1, axis)
+    return grown
@@ -9,7 +9,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 6)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -61,21 +61,14 @@ def perform(level, box, options):
     bid, bdata = options["Block:"].ID, options["Block:"].blockData
 
 
-    # Get the find and replace masks for the selection.
-    find_mask = find.mask(level, box)
-    replace_mask = replace.mask(level, box)
-
-    # Get the block mask. This is where the real work is.
-    mask = drip(find_mask, replace_mask, axis, sign, depth_min, depth_max,
-            chance)
-
-    # Place the blocks.
-    for ids, datas, slices in br.iterate(level, box, br.BLOCKS):
-        cur_mask = mask[slices]
-
-        # Set the blocks.
-        ids[cur_mask] = bid
-        datas[cur_mask] = bdata
+    # Drip in tiles, so that huge selections don't run out of memory. Drips
+    # only travel along the one axis, so as long as that axis isn't split the
+    # tiles don't need any halo.
+    changes = br.Changes()
+    axes = tuple(a for a in br.AXES if a != axis)
+    br.tiled(level, box, drip_tile, args=(find, replace, axis, sign, depth_min,
+            depth_max, chance, bid, bdata), axes=axes, cost=TILE_COST,
+            changes=changes)
 
 
     print "Finished dripping."
@@ -86,56 +79,79 @@ def perform(level, box, options):
     print "- depth min: {}".format(depth_min)
     print "- depth max: {}".format(depth_max)
     print "- chance: {}%".format(options["Chance%:"])
+    print "- changed: {}".format(changes)
     return
 
 
 
-def drip(find_mask, replace_mask, axis, sign, depth_min, depth_max, chance):
-    # Algorithm:
-    # Mask the find and replace blocks in the whole selection. Shift the find
-    # mask block by block, using logical & with the replace mask to select the
-    # positions to place blocks. Do this min depth times, then we need to add the
-    # random factor. To do this, cull a specific amount of the remaining matches
-    # and pretend they don't match. The exact amount is dependant on the
-    # difference between min and max depth. Then do the remaining shifts and &s,
-    # until the max depth is reached.
-
-
-    # Allocate some memory for shifting.
-    shifted = np.empty_like(find_mask)
-
-    # Use the original find matches as a seed, make sure to removed them after
-    # the shifting.
-    mask = np.copy(find_mask)
+# Rough bytes used per block by `drip_tile`.
+TILE_COST = 32
 
-    # Randomly cull now.
-    rand = np.random.random(find_mask.shape)
-    mask &= (rand < chance)
-
-
-    # Now do the initial shifting of the array, up to min depth.
-    for _ in range(depth_min):
-        br.shift(mask, sign, axis, out=shifted)
-
-        # Add intersection to matches.
-        mask |= (shifted & replace_mask)
-
-
-    # Now simulate the random depth, if necessary.
-    if depth_max > depth_min:
-        # Cull a random amount of replace matches to simulate random depth.
-        cull_prop = 1.0 / (depth_max - depth_min + 1)
-        rand = np.random.random(replace_mask.shape)
-        cull = (cull_prop > rand)
-        replace_mask[cull] = False # pretend they didn't match.
+# Drips the blocks of a tile, see `br.tiled`.
+def drip_tile(ids, datas, pad, tile, find, replace, axis, sign, depth_min,
+        depth_max, chance, bid, bdata):
+    # Get the find and replace masks for the tile.
+    find_mask = find.matches(ids, datas)
+    replace_mask = replace.matches(ids, datas)
 
+    # Get the block mask. This is where the real work is.
+    mask = drip(find_mask, replace_mask, axis, sign, depth_min, depth_max,
+            chance)
 
-        # Now do the final shifting and &ing.
-        for _ in range(depth_max - depth_min):
-            br.shift(mask, sign, axis, out=shifted)
-            mask |= (shifted & replace_mask)
+    # Place the blocks.
+    ids[mask] = bid
+    datas[mask] = bdata
 
 
-    # Remove the find matches which were added only to seed.
+def drip(find_mask, replace_mask, axis, sign, depth_min, depth_max, chance):
+    # Algorithm:
+    # Every drip runs along its column from a find block, through the replace
+    # blocks after it, for its own random length. So, give each block a "run"
+    # number of how many non-replace blocks are before it (and including it).
+    # Then a block is dripped on iff it's a replace block and some earlier find
+    # block in the same run has a drip reaching it. Combining the run and
+    # position of a block into a single key (`run * stride + position`), the
+    # furthest reaching drip of each run is just a running maximum along the
+    # column, so every depth is done in the same few passes.
+
+
+    # Flip backwards drips so that every drip goes forwards.
+    if sign < 0:
+        flip = br.slice_along(axis, None, None, -1)
+        find_mask = find_mask[flip]
+        replace_mask = replace_mask[flip]
+
+    # Randomly cull the find blocks, and get the length of each drip.
+    sources = np.copy(find_mask)
+    sources[sources] = (np.random.random(np.count_nonzero(sources)) < chance)
+    lengths = np.random.randint(depth_min, depth_max + 1,
+            size=np.count_nonzero(sources))
+
+    # Get the key of every block. The stride is large enough that no drip can
+    # reach into the next run.
+    length = find_mask.shape[axis]
+    stride = length + depth_max + 1
+    positions = np.arange(length).reshape(tuple(length if a == axis else 1
+            for a in br.AXES))
+    keys = np.cumsum(~replace_mask, axis=axis, dtype=np.int64)
+    keys *= stride
+    keys += positions
+
+    # Get the furthest key reached by any drip up-to each block.
+    reach = np.full(keys.shape, -1, dtype=np.int64)
+    reach[sources] = keys[sources] + lengths
+    np.maximum.accumulate(reach, axis=axis, out=reach)
+
+    # Place on the replace blocks reached by a drip from before them.
+    mask = np.zeros_like(replace_mask)
+    before = br.slice_along(axis, None, -1)
+    after = br.slice_along(axis, 1, None)
+    mask[after] = replace_mask[after]
+    mask[after] &= (reach[before] >= keys[after])
+
+    # Don't place on the find blocks.
     mask[find_mask] = False
+
+    if sign < 0:
+        mask = mask[flip]
     return mask
@@ -10,7 +10,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 3)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -147,7 +147,7 @@ NAMES = {eid: name for name, eids in ALL_IDS for eid in eids}
 # to only `tile_ids` and `entity_ids`. The position is in xyz order.
 def storages(level, box, tile_ids, entity_ids):
     # Find the items in the blocks.
-    for teid, pos, te in br.iterate(level, box, br.TES):
+    for teid, pos, te in br.iterate(level, box, br.TES, readonly=True):
         # Gotta be a storage that's getting checked.
         if teid not in tile_ids:
             continue
@@ -162,7 +162,8 @@ def storages(level, box, tile_ids, entity_ids):
 
 
     # Find the items in the entities.
-    for eid, pos, entity in br.iterate(level, box, br.ENTITIES):
+    for eid, pos, entity in br.iterate(level, box, br.ENTITIES,
+            readonly=True):
         # Gotta be a storage that's getting checked.
         if eid not in entity_ids:
             continue
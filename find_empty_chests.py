@@ -5,7 +5,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 3)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -26,7 +26,7 @@ def perform(level, box, options):
     print "Finding empty chests:"
 
     # Iterate the tile entities.
-    for teid, pos, te in br.iterate(level, box, br.TES):
+    for teid, pos, te in br.iterate(level, box, br.TES, readonly=True):
         # Check it's a chest. First value is for pre 1.11, others for post.
         if teid not in {"Chest", "chest", "minecraft:chest"}:
             continue
@@ -8,7 +8,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 4)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -44,7 +44,9 @@ def perform(level, box, options):
 
     # Do the thang. Note this filter is holey, because missing chunks can just be
     # skipped without consequence.
-    for ids, datas, slices in br.iterate(level, box, br.BLOCKS, holey=True):
+    changes = br.Changes()
+    for ids, datas, slices in br.iterate(level, box, br.BLOCKS, holey=True,
+            changes=changes):
         # Get the block matches (she was a moth to the flame type shit).
         mask = replace.matches(ids, datas)
 
@@ -67,6 +69,7 @@ def perform(level, box, options):
     print "- block 1: ({}:{})".format(bid1, bdata1)
     print "- block 2: ({}:{})".format(bid2, bdata2)
     print "- swap blocks: {}".format(bool(swap))
+    print "- changed: {}".format(changes)
     # you ever just wanna eat a shoe.
     # i eat sneakers.
     return
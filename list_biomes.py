@@ -8,7 +8,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 3)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -30,7 +30,7 @@ def perform(level, box, options):
 
     # Get all occuring ids and how much they occur.
     totals = defaultdict(int)
-    for biomes, _ in br.iterate(level, box, br.BIOMES):
+    for biomes, _ in br.iterate(level, box, br.BIOMES, readonly=True):
         # Get the unique biomes and counts.
         biome_ids, counts = np.unique(biomes, return_counts=True)
         # Add them to totals.
@@ -76,7 +76,7 @@ def perform(level, box, options):
         # Get an array of all the biomes.
         shape = br.shape(box)[:2] # xz shape.
         all_biomes = np.empty(shape, dtype=np.uint8)
-        for biomes, slices in br.iterate(level, box, br.BIOMES):
+        for biomes, slices in br.iterate(level, box, br.BIOMES, readonly=True):
             all_biomes[slices] = biomes
 
         # PRINT THE MAAP
@@ -1,4 +1,5 @@
 import numpy as np
+from itertools import product
 from pymclevel import alphaMaterials
 
 try:
@@ -8,7 +9,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 11)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -34,6 +35,19 @@ inputs = (
     ("Seed:", (0, 0, 10**9 - 1)),
     ("Scale:", (12, 1, 256)),
     ("Octaves:", (2, 1, 20)),
+    ("Seamless noise lines up with any other seamless noise of the same seed, "
+            "scale and octaves (so a huge area can be done in pieces).",
+            "label"),
+    ("Seamless?", False),
+    ("Gradient noise is smoother (like perlin noise). Worley noise is the "
+            "distance to the closest of some scattered points, so low values "
+            "make pockets around them. Worley edges is low along the edges "
+            "between the points' cells, for cracks (so use a small 'value max' "
+            "for thin cracks). These are always seamless.", "label"),
+    ("Engine:", ("Stuartian", "Gradient", "Worley", "Worley edges")),
+    ("Column noise only varies across x and z, every block in a column gets "
+            "the same value.", "label"),
+    ("Columns?", False),
     ("Value min:", (0.0, 0.0, 1.0)),
     ("Value max:", (0.4, 0.0, 1.0)),
     br.selector_explain("replace"),
@@ -48,6 +62,7 @@ inputs = (
 # implement in numpy, which is pretty much necessary to make it execute in <0.1s.
 # Oh but uh, why not just use perlin?
 # i din wanna
+# ok fine there's a perlin-style gradient noise too.
 
 
 def perform(level, box, options):
@@ -62,6 +77,9 @@ def perform(level, box, options):
     # Get those options.
     scale = options["Scale:"]
     octaves = options["Octaves:"]
+    seamless = options["Seamless?"]
+    engine = options["Engine:"]
+    columns = options["Columns?"]
     value_min = options["Value min:"]
     value_max = options["Value max:"]
 
@@ -72,108 +90,135 @@ def perform(level, box, options):
         raise Exception("'value max' cannot be smaller than 'value min'")
 
 
-    # Seed this thing.
-    np.random.seed(seed)
-
-
     # LETS MAAAAAKE SOOOME NOOOOOOOOOISE
-    noise = stuartian_noise(br.shape(box), scale, octaves)
-
-
-    if not visualise:
-        # Place on the blocks where the noise values are within the specified
-        # range.
-        mask = ((value_min <= noise) & (noise <= value_max))
-
-        # Iterate the blocks, in a holey manner because it's ok to just skip
-        # missing chunks.
-        for ids, datas, slices in br.iterate(level, box, br.BLOCKS, holey=True):
-            # Line up the matches and the mask.
-            cur_mask = (replace.matches(ids, datas) & mask[slices])
-
-            # Knock em down.
-            ids[cur_mask] = bid
-            datas[cur_mask] = bdata
-
+    # The noise is cached, since it's common to re-run with the same noise and
+    # only tweak the value range. Note the cached noise can't be modified.
+    # Column noise is just the noise of a single layer (with a height of 1),
+    # which then gets broadcast along y. Everything is done in a holey manner
+    # because it's ok to just skip missing chunks.
+    changes = br.Changes()
+    place_args = (replace, bid, bdata, value_min, value_max, visualise)
+    if seamless or engine != "Stuartian":
+        # Seamless noise only depends on the world position, so each tile can
+        # just make its own (without any halo). This also means it can be made
+        # in worker processes, see `br.WORKERS`.
+        br.tiled(level, box, seamless_tile, args=(engine, seed, scale, octaves,
+                columns) + place_args, cost=TILE_COST, changes=changes,
+                holey=True)
     else:
-        # Time to acsend.
-        # red - purple
-        rainbow = np.array([14, 1, 4, 5, 3, 9, 11, 10])
-
-        # Convert from the floating value to a value from 0 to len-1.
-        noise *= len(rainbow) - 1
-
-        wools = noise.astype(np.uint8)
-
-        # Convert from the indices to the wool data values.
-        for i in range(len(rainbow)):
-            wools[wools == i] = rainbow[i] + 16
-        wools -= 16
-
-        # Taste the rainbow bitch.
-        for ids, datas, slices in br.iterate(level, box, br.BLOCKS, holey=True):
-            ids[:] = 35 # wool id.
-            datas[:] = wools[slices]
+        cache = br.cache("noise")
+        shape = br.shape(box)
+        if columns:
+            shape = shape[:2] + (1,)
+        key = ("stuartian", seed, scale, octaves, shape)
+        noise = cache.get(key)
+        if noise is None:
+            # Seed this thing.
+            np.random.seed(seed)
+            noise = stuartian_noise(shape, scale, octaves)
+            cache.put(key, noise)
+
+        # The nodes are random, so the noise has to be made all at once and
+        # can't be split into tiles. Only dirty the chunks which actually get
+        # changed.
+        for ids, datas, slices in br.iterate(level, box, br.BLOCKS, holey=True,
+                changes=changes):
+            if columns:
+                slices = slices[:2] + (slice(None),)
+            place(ids, datas, noise[slices], *place_args)
 
 
     print "Finished making some noise."
     print "- seed: {}".format(seed)
     print "- scale: {}".format(scale)
     print "- octaves: {}".format(octaves)
+    print "- seamless: {}".format(seamless)
+    print "- engine: {}".format(engine)
+    print "- columns: {}".format(columns)
     print "- value min: {}".format(value_min)
     print "- value max: {}".format(value_max)
+    print "- changed: {}".format(changes)
     return
 
 
 
-def stuartian_noise(shape, scale, octaves):
-    # Create the noise in a slightly larger region than the selection to avoid
-    # annoying issues with nodes being outside the region but obv still need to
-    # access them. It will be cut down before returning. Note that the nodes
-    # occur every `scale` blocks, that is there are `scale-1` blocks between
-    # them.
-    noise = np.random.random(map(lambda x: (x-2)/scale + 2, shape))
-    # this numpy verion dunt got the new random generator.
+# Rough bytes used per block by `seamless_tile`.
+TILE_COST = 40
 
+# Places seamless noise over a tile, see `br.tiled` and `place`.
+def seamless_tile(ids, datas, pad, tile, engine, seed, scale, octaves, columns,
+        *place_args):
+    origin = [pad.origin[i] for i in (0, 2, 1)]
+    shape = br.shape(pad)
+    if columns:
+        origin = origin[:2] + [0]
+        shape = shape[:2] + (1,)
 
-    # If every block is a node, there is no need to do anything. The `correct`
-    # function would leave data with scale=1 unchanged anyway so nothing is lost
-    # by doing this. Also when scale=1 there is no excess space.
-    if scale == 1:
-        return noise
+    # Note when ran in a worker process, the cache is a copy and anything put
+    # into it is lost.
+    cache = br.cache("noise")
+    key = ("seamless", engine, seed, scale, octaves, tuple(origin), shape)
+    noise = cache.get(key)
+    if noise is None:
+        noise = world_noise(engine, origin, shape, scale, octaves, seed,
+                flat=columns)
+        cache.put(key, noise)
 
+    place(ids, datas, noise, *place_args)
 
-    # Do the linear interpolation along each axis. This is where the meat of the
-    # smooth is. The lerp automatically fills in `scale-1` blocks between each
-    # successive element, so this pads the selection to roughly the size of the
-    # box, just slightly extended to incude the next node along.
-    for axis in br.AXES:
-        noise = lerp(noise, axis, scale)
 
+# Places the block on the `replace` blocks where the noise values are within the
+# specified range (broadcasting columns). If `visualise`, instead replaces every
+# block with wool coloured by its noise value.
+def place(ids, datas, noise, replace, bid, bdata, value_min, value_max,
+        visualise):
+    if not visualise:
+        mask = ((value_min <= noise) & (noise <= value_max))
+
+        # Line up the matches and the mask.
+        mask = (replace.matches(ids, datas) & mask)
 
-    # Trim the noise back to the shape of the box.
-    noise = noise[map(slice, shape)]
+        # Knock em down.
+        ids[mask] = bid
+        datas[mask] = bdata
 
+    else:
+        # Time to acsend.
+        # red - purple
+        rainbow = np.array([14, 1, 4, 5, 3, 9, 11, 10])
 
-    # Correct the values of the noise, which shifts the distribution such that
-    # it's roughly a uniform distribution. Currently, it's very centre-focussed
-    # so this just spreads it towards the edges of 0 and 1.
-    noise = correct(noise, scale)
+        # Taste the rainbow bitch.
+        # Convert from the floating value to a value from 0 to len-1, and then
+        # to the wool data values.
+        wools = (noise * (len(rainbow) - 1)).astype(np.uint8)
+        ids[:] = 35 # wool id.
+        datas[:] = rainbow[wools]
 
 
-    # Add the octaves by recursing with a smaller scale.
-    if octaves > 1:
-        # Impact value is arbitrary. It roughly controls how impactful the next
-        # octave is to the noise. 0.6 seems pretty good at causing some chaos
-        # without being all-consuming.
-        impact = 0.6
-        octave_scale = int((1.0 - impact) * scale)
 
-        # Only keep going if the scale is at least 1.
-        if octave_scale > 0:
-            noise += impact * stuartian_noise(shape, octave_scale, octaves - 1)
-            # Scale back to [0,1].
-            noise /= (1 + impact)
+# Impact value is arbitrary. It roughly controls how impactful each octave is to
+# the octave before it. 0.6 seems pretty good at causing some chaos without being
+# all-consuming.
+IMPACT = 0.6
+
+# Number of y layers of each octave which are generated at once. Only the nodes
+# and this many layers are ever held for an octave, on top of the noise itself.
+SLAB = 16
+
+
+def stuartian_noise(shape, scale, octaves):
+    # Every octave is a smaller scale noise, mixed in with some weight. Rather
+    # than generating each octave as a full volume and then mixing them, just
+    # add them all into the one array.
+    scales = octave_scales(scale, octaves)
+    noise = np.zeros(shape, dtype=np.float32)
+    for scale, weight in zip(scales, octave_weights(len(scales))):
+        # Create the nodes in a slightly larger region than the selection to
+        # avoid annoying issues with nodes being outside the region but obv
+        # still need to access them.
+        nodes = np.random.random([(x - 2)//scale + 2 for x in shape])
+        # this numpy verion dunt got the new random generator.
+        add_octave(noise, nodes.astype(np.float32), scale, weight)
 
     # Clip justin caseme.
     noise.clip(0.0, 1.0, out=noise)
@@ -182,50 +227,387 @@ def stuartian_noise(shape, scale, octaves):
     return noise
 
 
+# Returns the seamless noise of the given `engine` (a name from the inputs), see
+# `seamless_noise`. If `flat`, the noise is for columns (which only matters for
+# worley noise).
+def world_noise(engine, origin, shape, scale, octaves, seed, flat=False):
+    if engine == "Gradient":
+        return gradient_noise(origin, shape, scale, octaves, seed)
+    if engine == "Worley":
+        return worley_noise(origin, shape, scale, octaves, seed, flat=flat)
+    if engine == "Worley edges":
+        return worley_noise(origin, shape, scale, octaves, seed, edges=True,
+                flat=flat)
+    return seamless_noise(origin, shape, scale, octaves, seed)
+
+
+# Same as `stuartian_noise`, except the nodes are a hash of their world position
+# instead of random. So, any noise with the same seed lines up perfectly with
+# any other, no matter where it's generated. `origin` is the world position of
+# the first block, in xzy order.
+def seamless_noise(origin, shape, scale, octaves, seed):
+    scales = octave_scales(scale, octaves)
+    noise = np.zeros(shape, dtype=np.float32)
+    for octave, (scale, weight) in enumerate(zip(scales,
+            octave_weights(len(scales)))):
+        # Find the world nodes around the noise, and where the noise starts
+        # after the first node.
+        first = [o // scale for o in origin]
+        last = [(o + n - 1)//scale + 1 for o, n in zip(origin, shape)]
+        starts = [o - f*scale for o, f in zip(origin, first)]
+
+        # Get the nodes, from the xzy node coordinates.
+        x, z, y = [np.arange(f, l + 1) for f, l in zip(first, last)]
+        nodes = hash_unit(seed, octave, x[:, None, None], y[None, None, :],
+                z[None, :, None])
+        add_octave(noise, nodes, scale, weight, starts)
 
-def lerp(data, axis, scale):
-    # Note: don't go here w scale=1.
-    assert scale > 1
-
-    # Algorithm: repeat the data along the array in the positive direction until
-    # the node, multiply that all by some weight array which scales it correctly.
-    # Repeat for the negative direction and sum.
-
-    # Simple count down from [1, 0) in `scale` number of steps.
-    weights = np.arange(scale, 0, -1, dtype=float)
-    weights /= scale
-
-    # Pad the dimensions of weights and set it up along the correct axis.
-    pad_dims = (None,)*axis + (slice(None),) + (None,)*(data.ndim - axis - 1)
-    weights = weights[pad_dims]
+    noise.clip(0.0, 1.0, out=noise)
+    return noise
 
 
-    # Get the repeated data and weights for the positive "iteration".
-    repeated_pos = np.repeat(data, scale, axis=axis)
-    weighted_pos = np.tile(weights, data.shape)
+# Returns a list of the scale of each octave.
+def octave_scales(scale, octaves):
+    scales = [scale]
+    while len(scales) < octaves:
+        # If every block is a node, the octaves can't get any smaller.
+        if scale == 1:
+            break
+        # Only keep going if the scale is at least 1.
+        scale = int((1.0 - IMPACT) * scale)
+        if scale == 0:
+            break
+        scales.append(scale)
+    return scales
+
+
+# Returns a list of how much each of `count` octaves is weighted in the noise.
+# Each octave is mixed into the octave before it by `IMPACT`, and then scaled
+# back to [0,1].
+def octave_weights(count):
+    weights = [(1.0 / (1 + IMPACT)) * (IMPACT / (1 + IMPACT))**i
+            for i in range(count)]
+    # The last octave doesn't have an octave mixed into it, so doesn't get scaled
+    # back.
+    weights[-1] *= (1 + IMPACT)
+    return weights
+
+
+# Adds a single octave of noise to `noise`, multiplied by `weight`. The octave is
+# interpolated from `nodes`, which occur every `scale` blocks (that is there are
+# `scale-1` blocks between them). `starts` is how far the noise starts after the
+# first node, along each axis.
+def add_octave(noise, nodes, scale, weight, starts=(0, 0, 0)):
+    w, l, h = noise.shape
+    x_start, z_start, y_start = starts
 
-    # Now for the negative, take selective slices as if we'd repeated the data
-    # and weights in the negative direction. This is possible because `repeated`
-    # and `weighted` are too long by `scale-1` along the axis since they repeat
-    # the last element when it's in fact the end.
-    slice_from = br.slice_along(axis, scale - 1, None)
-    slice_until = br.slice_along(axis, None, 1 - scale)
+    # If every block is a node, there is no need to do anything. The `correct`
+    # function would leave data with scale=1 unchanged anyway so nothing is lost
+    # by doing this.
+    if scale == 1:
+        nodes = nodes[x_start:x_start + w, z_start:z_start + l,
+                y_start:y_start + h] * weight
+        noise += nodes
+        return
 
-    repeated_neg = repeated_pos[slice_from]
-    weighted_neg = 1 - weighted_pos[slice_until]
-    # To avoid double-counting at nodes, just set each node weight to 0.
-    weighted_neg[br.slice_along(axis, None, None, scale)] = 0.0
+    # Do the linear interpolation along each axis. This is where the meat of the
+    # smooth is. The lerp fills in `scale-1` blocks between each successive
+    # node. The x and z axes are done on just the y nodes, and then the y axis
+    # is done a slab at a time (straight into the noise) so that the full octave
+    # is never held at once.
+    nodes = lerp(nodes, br.AXIS_X, scale, w, x_start)
+    nodes = lerp(nodes, br.AXIS_Z, scale, l, z_start)
+    for start in range(0, h, SLAB):
+        size = min(SLAB, h - start)
+        slab = lerp(nodes, br.AXIS_Y, scale, size, y_start + start)
+
+        # Correct the values of the noise, which shifts the distribution such
+        # that it's roughly a uniform distribution. Currently, it's very
+        # centre-focussed so this just spreads it towards the edges of 0 and 1.
+        slab = correct(slab, scale)
+
+        slab *= weight
+        noise[:, :, start:start + size] += slab
+
+
+
+# Returns `size` blocks of the linear interpolation between the nodes of `data`
+# along the axis, where the nodes are `scale` blocks apart. The blocks start at
+# `start` (where block 0 is the first node).
+def lerp(data, axis, scale, size, start=0):
+    # Find the node before each block, and how far the block is towards the
+    # next node.
+    i = np.arange(start, start + size)
+    nodes = i // scale
+    after = (i % scale).astype(np.float32) / scale
+    before = 1 - after
+
+    # A block right on the last node has no next node, but it also doesn't need
+    # it.
+    next_nodes = np.minimum(nodes + 1, data.shape[axis] - 1)
+
+    return mix(data, axis, nodes, next_nodes, before, after)
+
+
+# Returns the mix of the nodes of `data` along the axis. Each block along the
+# axis is `before` times its node in `nodes` plus `after` times its node in
+# `next_nodes`.
+def mix(data, axis, nodes, next_nodes, before, after):
+    # Pad the dimensions of the weights and set them up along the correct axis.
+    pad_dims = (None,)*axis + (slice(None),) + (None,)*(data.ndim - axis - 1)
 
+    # Mix the two nodes.
+    mixed = np.take(data, nodes, axis=axis)
+    mixed *= before[pad_dims]
+    other = np.take(data, next_nodes, axis=axis)
+    other *= after[pad_dims]
+    mixed += other
+    return mixed
+
+
+
+# Gradient noise algorithm:
+# Same deal as perlin noise. Every node gets a random gradient (one of the 12
+# edge directions of a cube) and each block is the smoothly interpolated dot
+# product of the gradients of the nodes around it with the offset from each
+# node. This is separable, so each component of the gradients is interpolated
+# with `mix` along each axis (with the offset folded into the weights of its
+# own axis). Blocks are sampled at their centres, so that the noise isn't 0 on
+# every node.
+
+# The 12 gradients. The set is the same in any axis order.
+GRADIENTS = np.array([
+    (1, 1, 0), (-1, 1, 0), (1, -1, 0), (-1, -1, 0),
+    (1, 0, 1), (-1, 0, 1), (1, 0, -1), (-1, 0, -1),
+    (0, 1, 1), (0, -1, 1), (0, 1, -1), (0, -1, -1),
+], dtype=np.float32)
+
+# Standard deviation of a single octave of gradient noise, found empirically.
+GRADIENT_STD = 0.27
+
+
+# Returns gradient noise of the given `shape` with the first block at the world
+# position `origin` (xzy order), with values in [0,1]. Lines up with any other
+# gradient noise of the same seed.
+def gradient_noise(origin, shape, scale, octaves, seed):
+    scales = octave_scales(scale, octaves)
+    weights = octave_weights(len(scales))
+    noise = np.zeros(shape, dtype=np.float32)
+    for octave, (scale, weight) in enumerate(zip(scales, weights)):
+        add_gradient_octave(noise, origin, scale, weight, seed, octave)
+
+    # Gradient noise is roughly a normal distribution around 0, so squash it
+    # into [0,1] with (a logistic approximation of) the normal cdf. This makes it
+    # roughly uniform, the same as stuartian noise.
+    std = GRADIENT_STD * np.sqrt(np.sum(np.square(weights)))
+    noise *= np.float32(-1.702 / std)
+    np.exp(noise, out=noise)
+    noise += 1
+    np.reciprocal(noise, out=noise)
+    return noise
 
-    # Do positive direction, cutting down to the correct size.
-    lerped = weighted_pos[slice_until] * repeated_pos[slice_until]
 
-    # Do negative direction. This doesn't need any cutting just because of how
-    # it's setup.
-    lerped += weighted_neg * repeated_neg
+# Adds a single octave of gradient noise to `noise`, multiplied by `weight`.
+def add_gradient_octave(noise, origin, scale, weight, seed, octave):
+    # Find the node before each block, and the smoothed position of the block
+    # between it and the next node, along each axis.
+    firsts = []
+    cells = []
+    for o, n in zip(origin, noise.shape):
+        i = np.arange(o, o + n)
+        nodes = i // scale
+        pos = (i - nodes*scale + 0.5).astype(np.float32) / scale
+        smooth = pos * pos * pos * (pos * (pos * 6 - 15) + 10)
+        firsts.append(nodes[0])
+        cells.append((nodes - nodes[0], pos, smooth))
+
+    # Get the gradients of the nodes, from the xzy node coordinates.
+    x, z, y = [first + np.arange(nodes[-1] + 2)
+            for first, (nodes, _, _) in zip(firsts, cells)]
+    grads = GRADIENTS[hash_uint(seed, octave, x[:, None, None],
+            y[None, None, :], z[None, :, None]) % len(GRADIENTS)]
+
+    # Interpolate each component along y and z. Leave x until last, since
+    # taking along the first axis is the quickest (whole planes at a time).
+    parts = []
+    for component in br.AXES:
+        part = grads[..., component]
+        for axis in (br.AXIS_Y, br.AXIS_Z):
+            nodes, pos, smooth = cells[axis]
+            before = 1 - smooth
+            after = np.copy(smooth)
+            if axis == component:
+                before *= pos
+                after *= pos - 1
+            part = mix(part, axis, nodes, nodes + 1, before, after)
+        parts.append(part)
+
+    # Then x, where the y and z components have the same weights. Also weight
+    # the octave while at it.
+    nodes, pos, smooth = cells[br.AXIS_X]
+    before = (1 - smooth) * weight
+    after = smooth * weight
+    noise += mix(parts[br.AXIS_Y] + parts[br.AXIS_Z], br.AXIS_X, nodes,
+            nodes + 1, before, after)
+    noise += mix(parts[br.AXIS_X], br.AXIS_X, nodes, nodes + 1, before * pos,
+            after * (pos - 1))
+
+
+
+# Worley noise algorithm:
+# Split the world into cells of `scale` blocks, and scatter a single point
+# randomly within each cell. The noise of a block is then the distance to the
+# closest point, which can only be in the block's cell or one of the cells next
+# to it (so only those 27 cells need to be checked, however many points there
+# are). For edges, it's the difference between the distance to the closest and
+# second closest points, which is 0 right between two points. The distances
+# aren't uniformly distributed, so each octave is mapped through its quantiles
+# (to be roughly uniform) and then mixed like gradient noise.
+
+# Quantiles of a single octave of worley noise (as a fraction of the cell size)
+# at every 1/16th, found empirically. Indexed by `flat, edges`.
+WORLEY_QUANTILES = {
+    (False, False): [0.0, 0.247, 0.313, 0.360, 0.399, 0.434, 0.465, 0.495,
+            0.524, 0.552, 0.581, 0.610, 0.642, 0.678, 0.721, 0.781, 1.214],
+    (False, True): [0.0, 0.016, 0.033, 0.051, 0.070, 0.090, 0.111, 0.134,
+            0.159, 0.186, 0.216, 0.250, 0.288, 0.335, 0.395, 0.483, 1.182],
+    (True, False): [0.0, 0.141, 0.201, 0.247, 0.287, 0.324, 0.358, 0.391,
+            0.424, 0.456, 0.490, 0.524, 0.562, 0.604, 0.656, 0.728, 1.140],
+    (True, True): [0.0, 0.025, 0.051, 0.077, 0.105, 0.134, 0.164, 0.197,
+            0.230, 0.267, 0.306, 0.349, 0.398, 0.455, 0.525, 0.628, 1.265],
+}
+
+# Closest an octave's (roughly uniform) value is kept to 0 or 1, so that it has
+# a finite logit.
+WORLEY_EPSILON = 2.0**-10
+
+
+# Returns worley noise of the given `shape` with the first block at the world
+# position `origin` (xzy order), with values in [0,1]. Lines up with any other
+# worley noise of the same seed. If `edges`, returns the worley edges noise
+# instead. If `flat`, the noise is 2d, over only x and z (this does not line up
+# with 3d noise).
+def worley_noise(origin, shape, scale, octaves, seed, edges=False, flat=False):
+    scales = octave_scales(scale, octaves)
+    weights = octave_weights(len(scales))
+    noise = np.zeros(shape, dtype=np.float32)
+    for octave, (scale, weight) in enumerate(zip(scales, weights)):
+        add_worley_octave(noise, origin, scale, weight, seed, octave, edges,
+                flat)
+
+    # Each octave is a logistic distribution (see `add_worley_octave`), so their
+    # mix is roughly one too. Squash it back into [0,1] with the logistic
+    # function, which makes it roughly uniform (same as gradient noise).
+    noise *= np.float32(-1 / np.sqrt(np.sum(np.square(weights))))
+    np.exp(noise, out=noise)
+    noise += 1
+    np.reciprocal(noise, out=noise)
+    return noise
 
-    return lerped
 
+# Adds a single octave of worley noise to `noise`, multiplied by `weight`. The
+# arguments are the same as `worley_noise`.
+def add_worley_octave(noise, origin, scale, weight, seed, octave, edges, flat):
+    axes = (br.AXIS_X, br.AXIS_Z) if flat else br.AXES
+
+    # Find the cell of each block (counting from the cell before the first
+    # block), and the position of each block's centre within its cell.
+    firsts = []
+    cells = []
+    for axis, (o, n) in enumerate(zip(origin, noise.shape)):
+        if axis not in axes:
+            firsts.append(0)
+            cells.append((np.zeros(n, dtype=int), None))
+            continue
+        i = np.arange(o, o + n)
+        cell = i // scale
+        pos = (i - cell*scale + 0.5).astype(np.float32)
+        firsts.append(cell[0] - 1)
+        cells.append((cell - cell[0] + 1, pos))
+
+    # Get the point of every cell around the noise, relative to its cell. Note
+    # in 2d the cells are all at y=0.
+    x, z, y = [first + np.arange(cell[-1] + 2 if (axis in axes) else 1)
+            for axis, (first, (cell, _)) in enumerate(zip(firsts, cells))]
+    points = np.stack([hash_unit(seed, octave, axis, x[:, None, None],
+            y[None, None, :], z[None, :, None]) * scale for axis in axes],
+            axis=-1)
+
+    # Find the closest and second closest point of each block.
+    closest = np.full(noise.shape, np.inf, dtype=np.float32)
+    second = np.full(noise.shape, np.inf, dtype=np.float32)
+    dist = np.empty(noise.shape, dtype=np.float32)
+    offsets = [(-1, 0, 1) if (axis in axes) else (0,) for axis in br.AXES]
+    for offset in product(*offsets):
+        # Get the point of the offset cell for every block. Take along x last,
+        # since it's the quickest (whole planes at a time).
+        block_points = points
+        for axis in (br.AXIS_Y, br.AXIS_Z, br.AXIS_X):
+            cell, _ = cells[axis]
+            block_points = np.take(block_points, cell + offset[axis],
+                    axis=axis)
+
+        # Squared distance to it.
+        dist[:] = 0
+        for i, axis in enumerate(axes):
+            _, pos = cells[axis]
+            pad_dims = [None]*3
+            pad_dims[axis] = slice(None)
+            to_cell = (offset[axis]*scale - pos)[tuple(pad_dims)]
+            diff = block_points[..., i] + to_cell
+            diff *= diff
+            dist += diff
+
+        # Bump the closest along.
+        np.minimum(second, np.maximum(closest, dist), out=second)
+        np.minimum(closest, dist, out=closest)
+
+    # Get the distance, as a fraction of the cell size.
+    np.sqrt(closest, out=closest)
+    if edges:
+        np.sqrt(second, out=second)
+        closest = second - closest
+    closest *= np.float32(1.0 / scale)
+
+    # Make it roughly uniform through its quantiles, and then take the logit (the
+    # inverse of the logistic function) so that the octaves can be mixed.
+    quantiles = WORLEY_QUANTILES[flat, edges]
+    uniform = np.interp(closest, quantiles, np.linspace(0, 1, len(quantiles)))
+    uniform = uniform.astype(np.float32)
+    uniform.clip(WORLEY_EPSILON, 1 - WORLEY_EPSILON, out=uniform)
+    logit = np.log(uniform)
+    logit -= np.log1p(-uniform)
+    logit *= np.float32(weight)
+    noise += logit
+
+
+# Returns uniform random values in [0,1) for each of the given integer
+# coordinates (broadcast together), which are always the same for the same
+# arguments.
+def hash_unit(*coords):
+    h = hash_uint(*coords)
+    # Top 24 bits, which a float32 holds exactly.
+    return (h >> 8).astype(np.float32) * np.float32(1.0 / 2**24)
+
+
+# Same as `hash_unit`, except returns random uint32s.
+def hash_uint(*coords):
+    h = np.zeros(np.broadcast(*coords).shape, dtype=np.uint32)
+    for coord in coords:
+        h ^= np.asarray(coord).astype(np.uint32)
+        fmix32(h)
+    return h
+
+
+# Murmur3's finalizer, which thoroughly mixes the bits of a uint32 array
+# (in-place).
+def fmix32(h):
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x85ebca6b)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0xc2b2ae35)
+    h ^= h >> np.uint32(16)
+    return h
 
 
 def correct(noise, scale):
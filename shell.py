@@ -8,7 +8,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 2)
+    br.require_version(2, 4)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -34,7 +34,9 @@ def perform(level, box, options):
     shell = get_shell(box)
 
     # Place em (holey style).
-    for ids, datas, slices in br.iterate(level, box, br.BLOCKS, holey=True):
+    changes = br.Changes()
+    for ids, datas, slices in br.iterate(level, box, br.BLOCKS, holey=True,
+            changes=changes):
         mask = shell[slices]
         mask &= replace.matches(ids, datas)
 
@@ -45,6 +47,7 @@ def perform(level, box, options):
     print "Finished shelling."
     print "- replace: {}".format(replace)
     print "- block: ({}:{})".format(bid, bdata)
+    print "- changed: {}".format(changes)
     return
 
 
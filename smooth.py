@@ -9,7 +9,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 2)
+    br.require_version(2, 8)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -23,12 +23,44 @@ inputs = (
             "feathering, the edges of the selection will attempt to more "
             "smoothly join to the blocks outside of the selection.", "label"),
     ("Note that this WILL mess up any block variation.", "label"),
+    ("In heightfield mode, only the surface height of each column is smoothed "
+            "(the top non-air block in the selection), which is much quicker "
+            "for terrain. The columns are moved up/down to the new height.",
+            "label"),
+    ("The kernel is how much each block around a block counts towards it. The "
+            "gaussian and sphere kernels are rounder than the box kernel.",
+            "label"),
+    ("Mode:", ("Blocks", "Heightfield")),
+    ("Kernel:", ("Box", "Gaussian", "Sphere")),
     ("Strength:", (3, 1, 16)),
     ("Feather?", True),
 )
 
 count_type = np.uint16 # up-to 64k volume.
 
+# Number of heights a kernel is rounded to along each axis, when voting. Each
+# height is another box to sum (see `sum_vote`), but the cost doesn't depend on
+# the strength.
+VOTE_LEVELS = 7
+
+# Largest total of the weights of a kernel along each axis, when voting. The
+# counts are shifted down by `VOTE_SHIFT` bits after the second axis, which
+# ensures the total weight (cubed) fits in `count_type`.
+MAX_WEIGHT = 255
+VOTE_SHIFT = 8
+
+# Number of the most common blocks which are always counted everywhere when
+# voting. Any rarer blocks are only counted around where they actually are, and
+# only if they could possibly win.
+LABEL_CAP = 8
+
+# Rough bytes used per block by `smooth_tile`. Doesn't depend on the number of
+# different blocks, since they're counted one at a time.
+TILE_COST = 32
+# Same as `TILE_COST` but when feathering, which needs a table of 8 corner
+# indices for every block.
+FEATHER_TILE_COST = 104
+
 
 
 # Smoothing algorithm:
@@ -36,61 +68,49 @@ count_type = np.uint16 # up-to 64k volume.
 # block around that particular block, effectively averaging out any outliers. The
 # algorithm looks in a cube of radius `strength` around each block to determine
 # the most common, this is mostly because it is ridiculously quick when
-# implemented with numpy shifts and additions.
+# implemented with numpy shifts and additions. The other kernels weight the
+# blocks in the cube, to round it off.
 
 
 def perform(level, box, options):
+    mode = options["Mode:"]
+    kernel = options["Kernel:"]
     strength = options["Strength:"]
     feather = options["Feather?"]
 
+    # Only dirty the chunks which actually get changed.
+    changes = br.Changes()
 
-    if not feather:
+    if mode == "Heightfield":
+        # Heightfields are their own thing.
+        smooth_heightfield(level, box, strength, kernel, feather,
+                changes=changes)
+    elif not feather:
         # If no feather, simple call to `smooth`.
-        smooth(level, box, strength=strength)
+        smooth(level, box, strength=strength, kernel=kernel, changes=changes)
     else:
         # Otherwise we gotta pull a nasty feather algo on this bitch. The
         # algorithm is:
-        # - run the full smooth everywhere EXCEPT leave a "deadmans" space
-        #       around the edges of the selection.
+        # - the full strength smooth is used everywhere EXCEPT a "deadmans"
+        #       space around the edges of the selection.
         # - this space has a depth of `strength-1` blocks.
-        # - in shells starting from the already-smoothed area, runs smooths of
-        #       steadily decreasing strength.
-        # - these shell stack on-top of each other and creep towards the bounds
-        #       of selection.
-        # - all shells operate after the previous smooth is complete, they "see"
-        #       the block changes it produces.
-        # - eventually, the outer-most shell will be smoothed with strength 1.
+        # - within it, the smooth strength steadily decreases towards the
+        #       bounds of the selection, one block per layer.
+        # - eventually, the outer-most layer is smoothed with strength 1.
         # - done.
+        # This is all done in a single smooth, with each block using its own
+        # strength. Note this means each layer only "sees" the original blocks,
+        # unlike smoothing layer-by-layer from the inside out (where each layer
+        # would see the changes made by the layers before it). The results are
+        # very close, and it is `strength` times quicker. Also, only the blocks
+        # at full strength use the kernel, the others always use a box.
 
-        # Rename these things.
-        full_box = box
-        full_strength = strength
-
-        # The shells must have "time" to drop to a smooth strength of 1, so this
-        # is the inverse calc to ensure it can.
-        strength = min(full_strength, min((x + 1)/2 for x in full_box.size))
-
-        # Setup the mask array for smooth, initially all blocks are included.
-        mask = np.ones(br.shape(full_box), dtype=bool)
-
-        # Complete the full smooth on the inside section.
-        box = full_box.expand(-strength + 1) # shrink.
-        smooth(level, box, strength=strength)
+        # The layers must have "time" to drop to a smooth strength of 1, so this
+        # is the inverse calc to ensure they can.
+        feather_strength = min(strength, min((x + 1)/2 for x in box.size))
 
-        # Now iterate through the shells, inner-most to outer-most.
-        for s in range(strength - 1, 0, -1):
-            # Maks out the earlier smooths.
-            mask[br.submask(full_box, box)] = False
-            # Include this shell's mask.
-            box = box.expand(1)
-            shell = mask[br.submask(full_box, box)]
-
-            # SHMOOTH
-            smooth(level, box, strength=s, mask=shell)
-
-        # Restore the thangs for logging purposes.
-        strength = full_strength
-        box = full_box
+        smooth(level, box, strength=feather_strength, kernel=kernel,
+                changes=changes, feather=True)
 
 
     # For a couple laughs just to break up the monotony, calculate a score of how
@@ -98,45 +118,244 @@ def perform(level, box, options):
     # NO. no cheeky laughs to break up the monotony. back to work.
 
     print "Finished smoothing:"
+    print "- mode: {}".format(mode)
+    print "- kernel: {}".format(kernel)
     print "- strength: {}".format(strength)
     print "- feather: {}".format(feather)
+    print "- changed: {}".format(changes)
     return
 
 
 
-# Performs a smooth of `strength` over `box`. If `mask` is non-none, it is a
-# boolean mask of blocks to modify.
-def smooth(level, box, strength, mask=None):
+# Performs a smooth of `strength` over `box`, using the given `kernel` (a name
+# from the inputs). If `mask` is non-none, it is a boolean mask of blocks to
+# modify. The changes are tallied into `changes`, if given. If `feather`, the
+# strength drops off towards the edges of `box`, such that the outer-most layer
+# has a strength of 1.
+def smooth(level, box, strength, kernel="Box", mask=None, changes=None,
+        feather=False):
     # Get the neighbourhood box, which includes some extra blocks in each
-    # direction.
-    nbh = get_neighbourhood(level, box, strength)
-
-    # Cache all the blocks and their locations.
-    blocks = extract(level, nbh)
-
-    # "Smear" the blocks to their surrounding, effectively "smoothing" the
-    # blocks.
-    smear(blocks, strength)
-
-    # Extract the most common block at each location.
-    bids, bdatas = most_common(blocks)
-
-    # Trim the new blocks to the selection, instead of the entire neighbourhood.
-    bids = bids[br.submask(nbh, box)]
-    bdatas = bdatas[br.submask(nbh, box)]
-
-    # Set the blocks. Not holey because the rest of the algorithm cant be.
-    for ids, datas, slices in br.iterate(level, box, br.BLOCKS):
-        if mask is not None:
-            # Use the mask if supplied.
-            m = mask[slices]
-            ids[m] = bids[slices][m]
-            datas[m] = bdatas[slices][m]
-        else:
-            # Otherwise overwrite all blocks.
-            ids[:] = bids[slices]
-            datas[:] = bdatas[slices]
+    # direction. When feathering, no block looks further than 1 block outside
+    # the selection.
+    nbh = get_neighbourhood(level, box, 1 if feather else strength)
+
+    # The feathering needs the selection to know how far each block is from
+    # its edges.
+    edges = br.box_tuple(box) if feather else None
+    cost = FEATHER_TILE_COST if feather else TILE_COST
+
+    # The box kernel has its own (quicker) counting.
+    weights = None if (kernel == "Box") else vote_weights(kernel, strength)
+
+    # Smooth in tiles, so that huge selections don't run out of memory. Each
+    # tile needs to see the `strength` blocks around it, but nothing outside the
+    # neighbourhood. Only sets the masked blocks, if supplied.
+    br.tiled(level, box, smooth_tile, args=(strength, edges, weights),
+            halo=strength, bounds=nbh, cost=cost, mask=mask, changes=changes)
+
+
+# Smooths the blocks of a tile, see `br.tiled`. If `edges` is non-none, it is
+# the `(origin, size)` of the selection to feather towards. If `weights` is
+# non-none, it is the kernel to vote with (see `vote_weights`), otherwise a box
+# is used.
+def smooth_tile(ids, datas, pad, tile, strength, edges=None, weights=None):
+    # Label each location by which block is there.
+    (bids, bdatas), labels = label(ids, datas)
+
+    # Most of a typical selection is solid stone or open air, where the most
+    # common block is obviously the block already there. So, only bother voting
+    # at the locations (in the tile) which have a mix of blocks around them.
+    core = br.submask(pad, tile)
+    best = np.copy(labels[core])
+    vote = np.zeros(labels.shape, dtype=bool)
+    vote[core] = mixed(labels, strength)[core]
+
+    # Get the strength of each location, if it varies.
+    radii = None
+    if edges is not None:
+        radii = feather_radii(BoundingBox(*edges), pad, strength)
+
+    # Only need to count blocks within `strength` of the voting locations.
+    crop = br.bounding_slices(vote, strength)
+    if crop is not None:
+        # Find the most common block at each voting location.
+        if radii is not None:
+            radii = radii[crop]
+        best[vote[core]] = most_common(labels[crop], strength, vote[crop],
+                radii, weights)
+
+    # Convert back from the labels.
+    ids[core] = bids[best]
+    datas[core] = bdatas[best]
+
+
+
+# Returns an array of the feathered strength at each location in `pad`, which is
+# `strength` but dropping to 1 on the outer-most layer of `box`. Only feathers
+# along the given `axes`, the other axes have a length of 1 in the array.
+def feather_radii(box, pad, strength, axes=br.AXES):
+    # Find the distance to the closest edge of the box, along each axis.
+    dims = [n if (axis in axes) else 1 for axis, n in enumerate(br.shape(pad))]
+    radii = np.full(dims, strength, dtype=np.uint8)
+    for axis, i in zip(br.AXES, (0, 2, 1)): # xzy order, in xyz boxes.
+        if axis not in axes:
+            continue
+        coords = np.arange(pad.origin[i], pad.maximum[i])
+        dist = np.minimum(coords - box.origin[i], box.maximum[i] - 1 - coords)
+        dist = np.clip(dist + 1, 0, strength).astype(np.uint8)
+        pad_dims = [None]*3
+        pad_dims[axis] = slice(None)
+        np.minimum(radii, dist[tuple(pad_dims)], out=radii)
+    return radii
+
+
+# Performs a heightfield smooth of `strength` over `box`. Instead of voting on
+# every block, this finds the surface height of each column, smooths that with
+# the given `kernel`, and then moves each column up or down to its new height.
+# Very quick, since it's just some 2d arrays. When feathering, the change in
+# height drops off towards the x/z edges of the selection. The changes are
+# tallied into `changes`, if given.
+def smooth_heightfield(level, box, strength, kernel, feather, changes=None):
+    # Only need the columns around the selection, not above/below it.
+    nbh = box.expand(strength, 0, strength)
+    if not br.chunks_exist(level, box):
+        raise Exception("Selection cannot contain missing chunks.")
+    if not br.chunks_exist(level, nbh):
+        raise Exception("Selection is too close to missing chunks.")
+
+    # Smooth the heights (as floats, so that the averages aren't truncated).
+    heights = surface_heights(level, nbh)
+    weights = kernel_weights(kernel, strength)
+    smoothed = heights.astype(np.float32)
+    sum_weighted(smoothed, weights)
+    smoothed /= weights.sum() ** smoothed.ndim
+
+    # Only need the selection now.
+    inside = (slice(strength, -strength),) * 2
+    heights = heights[inside]
+    smoothed = smoothed[inside]
+
+    # Feathering just blends the new heights into the old ones.
+    if feather:
+        radii = feather_radii(box, box, strength, axes=(br.AXIS_X, br.AXIS_Z))
+        blend = radii[:, :, 0] / float(strength)
+        smoothed = heights + blend * (smoothed - heights)
+
+    # Move the columns.
+    new_heights = np.rint(smoothed).astype(heights.dtype)
+    for ids, datas, slices in br.iterate(level, box, br.BLOCKS,
+            changes=changes):
+        xz = slices[:2]
+        move_columns(ids, datas, heights[xz], new_heights[xz])
+
+
+# Returns a 2d xz array of the height of the surface of each column in `box`,
+# which is the number of blocks up-to and including the top non-air block (so 0
+# for an all-air column).
+def surface_heights(level, box):
+    w, l, h = br.shape(box)
+    heights = np.zeros((w, l), dtype=np.int32)
+    for ids, datas, slices in br.iterate(level, box, br.BLOCKS, readonly=True):
+        solid = (ids != 0)
+        # Find the first solid block from the top.
+        top = np.argmax(solid[:, :, ::-1], axis=br.AXIS_Y)
+        heights[slices[:2]] = np.where(np.any(solid, axis=br.AXIS_Y), h - top, 0)
+    return heights
+
+
+# Moves each column of blocks up/down so that its surface height changes from
+# `heights` to `new_heights`. Everything above the new surface is air, and when
+# moving up the bottom block is repeated to fill the gap.
+def move_columns(ids, datas, heights, new_heights):
+    w, l, h = ids.shape
+    ys = np.arange(h)
+
+    # Get where each new block comes from.
+    x = np.arange(w)[:, None, None]
+    z = np.arange(l)[None, :, None]
+    y = ys[None, None, :] - (new_heights - heights)[:, :, None]
+    np.clip(y, 0, h - 1, out=y)
+    air = (ys[None, None, :] >= new_heights[:, :, None])
+
+    # Move em.
+    ids[:] = np.where(air, 0, ids[x, z, y])
+    datas[:] = np.where(air, 0, datas[x, z, y])
+
+
+# Returns the 1d weights of the given `kernel` (a name from the inputs), which
+# has a radius of `strength`. The kernel is separable, so the weight of a cell is
+# the product of the weights along each axis.
+def kernel_weights(kernel, strength):
+    offsets = np.arange(-strength, strength + 1)
+    if kernel == "Box":
+        return np.ones(len(offsets), dtype=np.float32)
+    if kernel == "Gaussian":
+        # Make the edge of the kernel 2 standard deviations out.
+        sigma = strength / 2.0
+        return np.exp(-offsets**2 / (2 * sigma**2)).astype(np.float32)
+    if kernel == "Sphere":
+        # A sphere isn't separable, but a circle along each axis rounds off the
+        # corners close enough.
+        return np.sqrt(1 - (offsets / (strength + 1.0))**2).astype(np.float32)
+    raise Exception("Unknown kernel: {}".format(kernel))
+
+
+# Returns the integer 1d weights of the given `kernel`, for voting. These are
+# rounded to `VOTE_LEVELS` heights (so the tails are kept, and the kernel is a
+# stack of that many boxes at most), then scaled to total at most `MAX_WEIGHT`.
+# Since the strength is at most 16, the levels total at most 7 * 33 (which is
+# under `MAX_WEIGHT`), so they're never scaled to 0.
+def vote_weights(kernel, strength):
+    weights = kernel_weights(kernel, strength)
+    levels = np.round(weights * (VOTE_LEVELS / weights.max()))
+    levels *= MAX_WEIGHT // int(levels.sum())
+    return levels.astype(count_type)
+
+
+# In-place sums the cells around each cell, weighted by the separable kernel
+# `weights` (a 1d array of odd length, where the middle weight is for the cell
+# itself). Out of bounds cells are clamped, same as `sum_cube`.
+def sum_weighted(array, weights):
+    radius = len(weights) // 2
+    total = np.empty_like(array)
+    shifted = np.empty_like(array)
+    for axis in range(array.ndim):
+        total[:] = 0
+        for by, weight in zip(range(-radius, radius + 1), weights):
+            if weight == 0:
+                continue
+            br.shift(array, by, axis, clamp=True, out=shifted)
+            shifted *= weight
+            total += shifted
+        array[:] = total
+
+
+# In-place sums the cells around each cell, weighted by the separable vote kernel
+# `weights` (see `vote_weights`). Along each axis the kernel is a stack of boxes,
+# one for each height, which are each summed from the same `line_cumsum`. Out of
+# bounds cells are clamped, same as `sum_cube`. Note the sums are shifted down
+# (rounding) by `VOTE_SHIFT` bits after the second axis.
+def sum_vote(array, weights):
+    # Get the weight of the box of each radius, which is the drop in the kernel
+    # just past that radius.
+    half = weights[len(weights) // 2:].astype(np.intp)
+    steps = half - np.append(half[1:], 0)
+
+    total = np.empty_like(array)
+    boxed = np.empty_like(array)
+    for axis in br.AXES:
+        cumsum = line_cumsum(array, axis)
+        total[:] = 0
+        for size in np.flatnonzero(steps):
+            sum_window(cumsum, int(size), axis, out=boxed)
+            boxed *= steps[size]
+            total += boxed
+        array[:] = total
+        del cumsum
 
+        if axis == br.AXES[1]:
+            array += 1 << (VOTE_SHIFT - 1)
+            array >>= VOTE_SHIFT
 
 
 # Returns the neighbourhood box.
@@ -168,68 +387,277 @@ def get_neighbourhood(level, box, strength):
     return nbh
 
 
-# Returns a dictionary of blocks (as `bid, bdata`) to a `count_type` array of
-# their locations in selection (where =0 does not match and =1 means matches).
-def extract(level, nbh):
-    blocks = {}
-
-    # Go through all the unique blocks in the selection.
-    for ids, datas, slices in br.iterate(level, nbh, br.BLOCKS):
-        for block in br.unique_blocks(ids, datas):
-            # If this is the first time this block showed up, we must assume it's
-            # never showed up anyway and initialise to zeroes.
-            if block not in blocks:
-                blocks[block] = np.zeros(br.shape(nbh), dtype=count_type)
-
-            # Update this block's mask.
-            bid, bdata = block
-            blocks[block][slices] = ((ids == bid) & (datas == bdata))
+# Returns a tuple of `(bids, bdatas), labels`. `bids` and `bdatas` are arrays of
+# every unique block (sorted), and `labels` is an array of the index of the
+# block at each location.
+def label(ids, datas):
+    # Merge id and data into a single key (which fits since ids are 12 bits).
+    keys = ids * br.DATA_COUNT
+    keys += datas
 
-    return blocks
+    # Get all the unique blocks, and a lookup from key to its label.
+    unique = np.unique(keys)
+    lookup = np.zeros(br.ID_COUNT * br.DATA_COUNT, dtype=np.uint16)
+    lookup[unique] = np.arange(len(unique))
+    labels = lookup[keys]
 
-
-# Adds all neighbour influences to each block's array.
-def smear(blocks, strength):
-    # Allocate two arrays that are used for temporary memory.
-    example_mask = blocks.values()[0]
-    tmp1 = np.empty_like(example_mask)
-    tmp2 = np.empty_like(example_mask)
-
-    # Add in a cube for each block.
-    for mask in blocks.values():
-        sum_cube(mask, strength, tmp1, tmp2)
+    # Unmerge.
+    bids = (unique // br.DATA_COUNT).astype(ids.dtype)
+    bdatas = (unique % br.DATA_COUNT).astype(datas.dtype)
+    return (bids, bdatas), labels
 
 
 # Simple algorithm to in-place sum in a cube of radius `size` around each cell.
-def sum_cube(array, size, tmp1, tmp2):
+def sum_cube(array, size):
     # Across axes, a stack-on effect is desired.
     for axis in br.AXES:
-        # Within an axis however, that stack-on would make a non-linear sum.
-        tmp1[:] = array
-        for by in range(-size, size + 1):
-            if by == 0: # don't double-count indices with themselves.
-                continue
-            # Add the neighbours, using clamp to avoid excessively filling void
-            # around the world top/bottom (instead assuming the closest layer was
-            # repeated out of bounds).
-            array += br.shift(tmp1, by, axis, clamp=True, out=tmp2)
-
-
-# Returns a tuple of `bids, bdatas`, where each block is the most common of the
-# blocks at that location.
-def most_common(blocks):
-    # Get a 4d array of all block counts.
-    all_blocks = np.stack(list(blocks.values()))
-
-    # Find the index (into `blocks`) of the most common block (which will have
-    # the maximum count).
-    most_common_indices = np.argmax(all_blocks, axis=0)
-
-    # Get a numpy vectorized function to convert the indices to the block id and
-    # data.
-    index = list(blocks.keys())
-    lookup = np.vectorize(lambda i: index[i])
-
-    # Return the thang. Note that this numpy vectorized function will return a
-    # tuple of arrays (not an array of tuples, however that would work).
-    return lookup(most_common_indices)
+        sum_line(array, size, axis)
+
+
+# In-place sums the cells within `size` of each cell along the axis. Uses a
+# cumulative sum (aka an integral image), so that the cost doesn't depend on
+# `size`. Out of bounds cells are clamped, same as `br.shift(..., clamp=True)`,
+# to avoid excessively filling void around the world top/bottom (instead
+# assuming the closest layer was repeated out of bounds).
+def sum_line(array, size, axis):
+    sum_window(line_cumsum(array, axis), size, axis, out=array)
+
+
+# Returns the cumulative sum of the array along the axis with a leading zero, so
+# that the sum of cells [a, b) is `cumsum[b] - cumsum[a]`. Note this will
+# overflow, but since the final sums can't, the wrapping all cancels out.
+def line_cumsum(array, axis):
+    shape = list(array.shape)
+    shape[axis] += 1
+    cumsum = np.zeros(shape, dtype=array.dtype)
+    np.cumsum(array, axis=axis, dtype=array.dtype,
+            out=cumsum[br.slice_along(axis, 1, None)])
+    return cumsum
+
+
+# Sets `out` to the sums of the cells within `size` of each cell along the axis,
+# given their `line_cumsum`. See `sum_line`.
+def sum_window(cumsum, size, axis, out):
+    n = out.shape[axis]
+
+    # Sum the in-bounds cells of each window.
+    i = np.arange(n)
+    np.take(cumsum, np.minimum(i + size + 1, n), axis=axis, out=out)
+    out -= np.take(cumsum, np.maximum(i - size, 0), axis=axis)
+
+    # Add the clamped cells, which are just repeats of the first/last slice.
+    pad_dims = (None,)*axis + (slice(None),) + (None,)*(out.ndim - axis - 1)
+    first = cumsum[br.slice_along(axis, 1, 2)]
+    last = cumsum[br.slice_along(axis, n, n + 1)]
+    last = last - cumsum[br.slice_along(axis, n - 1, n)]
+    below = np.maximum(size - i, 0).astype(out.dtype)
+    above = np.maximum(i + size - (n - 1), 0).astype(out.dtype)
+    k = min(size, n) # number of slices with clamped cells, at each end.
+    out[br.slice_along(axis, None, k)] += below[:k][pad_dims] * first
+    out[br.slice_along(axis, n - k, None)] += above[n - k:][pad_dims] * last
+
+
+# Returns a boolean array of the locations which have more than one label within
+# `strength` of them. May overestimate by a block or so, but never misses any.
+def mixed(labels, strength):
+    # Mark any location which differs from its neighbour below it along any axis.
+    # Any cube which isn't a single label must then contain a mark.
+    marks = np.zeros(labels.shape, dtype=count_type)
+    shifted = np.empty_like(labels)
+    for axis in br.AXES:
+        br.shift(labels, 1, axis, clamp=True, out=shifted)
+        marks |= (labels != shifted)
+
+    # Count the marks around each location.
+    sum_cube(marks, strength)
+    return (marks != 0)
+
+
+# Returns a 1d array of the most common label within `strength` of each location
+# in `where`. Ties go to the lower label. If `radii` is non-none, it is an array
+# of the strength to use at each location instead (all at most `strength`). If
+# `weights` is non-none, the labels are counted with that kernel (see
+# `vote_weights`) instead of a box, except at locations with a reduced radius.
+def most_common(labels, strength, where, radii=None, weights=None):
+    # Instead of counting every label at once and then finding the max (which
+    # needs memory for every label), count them one at a time and keep a running
+    # best.
+    size = np.count_nonzero(where)
+    best = np.zeros(size, dtype=np.uint16)
+    best_count = np.zeros(size, dtype=count_type)
+
+    # Only the labels that are actually here can win. Count the most common
+    # ones first, everywhere.
+    totals = np.bincount(labels.ravel())
+    ranked = np.argsort(-totals, kind="mergesort")
+    ranked = ranked[totals[ranked] > 0]
+    common, rare = ranked[:LABEL_CAP], ranked[LABEL_CAP:]
+
+    everywhere = np.arange(size)
+    count = counter(labels, strength, where, radii, weights)
+    for label in common:
+        update_best(best, best_count, label, count(label), everywhere)
+
+    # Detailed builds can have hundreds of rare blocks, which would each need a
+    # full count. But a rare block only has counts near where it is, and can
+    # only win where its total could beat the current best.
+    if len(rare) == 0:
+        return best
+
+    # Get the index into `best` of each location.
+    index = np.zeros(labels.shape, dtype=np.intp)
+    index[where] = everywhere
+
+    # Most a single block can add to a count, along each axis. Blocks on the
+    # edge of the array can be counted multiple times, due to the clamping. The
+    # weighted counts are also shifted down after the second axis, which can
+    # round each of the final axis' sums up by at most a half.
+    if weights is None:
+        peak, edge_peak = 1, 2*strength + 1
+    else:
+        peak, edge_peak = int(weights.max()), max(int(weights.sum()),
+                2*strength + 1)
+
+    for label, cells in rare_cells(labels, rare):
+        # Find the bounds of this block.
+        lo = [c.min() for c in cells]
+        hi = [c.max() for c in cells]
+        bound = len(cells[0])
+        for axis in br.AXES:
+            edge = (lo[axis] == 0 or hi[axis] == labels.shape[axis] - 1)
+            bound *= edge_peak if edge else peak
+        if weights is not None:
+            bound = (bound >> VOTE_SHIFT) + int(weights.sum()) // 2 + 1
+
+        # Only the locations within `strength` can count it.
+        region = tuple(slice(max(l - strength, 0), h + strength + 1)
+                for l, h in zip(lo, hi))
+        region_where = where[region]
+        at = index[region][region_where]
+        if len(at) == 0 or bound < best_count[at].min():
+            continue
+
+        # Count it properly. Note the clamping is the same, since the region is
+        # either clamped at the same edge or doesn't have the block on its edge.
+        region_radii = None if (radii is None) else radii[region]
+        count = counter(labels[region], strength, region_where, region_radii,
+                weights)
+        update_best(best, best_count, label, count(label), at)
+
+    return best
+
+
+# Updates the running `best` label and `best_count` (at the indices `at`) with
+# the `counts` of `label`. Ties go to the lower label, regardless of the order
+# the labels are counted in.
+def update_best(best, best_count, label, counts, at):
+    better = (counts > best_count[at])
+    better |= (counts == best_count[at]) & (label < best[at])
+    at = at[better]
+    best[at] = label
+    best_count[at] = counts[better]
+
+
+# Yields `label, cells` for each of the `rare` labels (in order), where `cells`
+# is a tuple of the coordinates of every location with that label.
+def rare_cells(labels, rare):
+    # Find all the rare locations at once, grouped by label.
+    is_rare = np.zeros(labels.max() + 1, dtype=bool)
+    is_rare[rare] = True
+    cells = np.flatnonzero(is_rare[labels])
+    cell_labels = labels.ravel()[cells]
+    order = np.argsort(cell_labels, kind="mergesort")
+    cells = cells[order]
+    cell_labels = cell_labels[order]
+
+    # Split into each label.
+    starts = np.flatnonzero(np.diff(cell_labels)) + 1
+    groups = dict(zip(cell_labels[np.r_[0, starts]], np.split(cells, starts)))
+    for label in rare:
+        yield label, np.unravel_index(groups[label], labels.shape)
+
+
+# Returns a function which, given a label, returns a 1d array of its count
+# around each location in `where`. The arguments are the same as `most_common`.
+def counter(labels, strength, where, radii=None, weights=None):
+    if radii is None:
+        return cube_counter(labels, strength, where, weights)
+    if weights is None:
+        return radii_counter(labels, strength, where, radii)
+    return feather_counter(labels, strength, where, radii, weights)
+
+
+# Returns a function which, given a label, returns a 1d array of its count
+# within `strength` of each location in `where`. If `weights` is non-none, the
+# counts are weighted by that kernel.
+def cube_counter(labels, strength, where, weights=None):
+    where = np.flatnonzero(where)
+    counts = np.empty(labels.shape, dtype=count_type)
+
+    def count(label):
+        np.equal(labels, label, out=counts)
+        if weights is None:
+            sum_cube(counts, strength)
+        else:
+            sum_vote(counts, weights)
+        return counts.ravel()[where]
+    return count
+
+
+# Same as `cube_counter` with `weights`, except the locations with a `radii` less
+# than `strength` are counted with a box of that radius instead (see
+# `radii_counter`).
+def feather_counter(labels, strength, where, radii, weights):
+    full = np.zeros_like(where)
+    full[where] = (radii[where] == strength)
+    is_full = full[where]
+    count_full = cube_counter(labels, strength, full, weights)
+    count_rest = radii_counter(labels, strength, where & ~full, radii)
+
+    def count(label):
+        counts = np.empty(len(is_full), dtype=count_type)
+        counts[is_full] = count_full(label)
+        counts[~is_full] = count_rest(label)
+        return counts
+    return count
+
+
+# Same as `cube_counter`, except each location counts within its own radius,
+# given by `radii`. Uses a 3d cumulative sum (aka a summed-area table), so that
+# any cube can be counted from its 8 corners.
+def radii_counter(labels, strength, where, radii):
+    # Repeat the edges out-of-bounds to clamp the same as `sum_line`. Also give
+    # the table a leading zero on each axis, so that the cells [a, b) are
+    # `table[b] - table[a]` along each axis. Like `sum_line` this will overflow,
+    # but it all cancels out.
+    padded = np.pad(labels, strength, mode="edge")
+    table = np.zeros(tuple(n + 1 for n in padded.shape), dtype=count_type)
+    counts = table[1:, 1:, 1:]
+
+    # Get the start and end of each cube along each axis.
+    where = np.nonzero(where)
+    radii = radii[where].astype(np.intp)
+    starts = [w + (strength - radii) for w in where]
+    ends = [w + (strength + radii + 1) for w in where]
+
+    # Get the (flat) index of each corner, and whether it adds or subtracts.
+    corners = []
+    for picks in product((False, True), repeat=3):
+        coords = [e if p else s for s, e, p in zip(starts, ends, picks)]
+        index = np.ravel_multi_index(coords, table.shape)
+        corners.append((index, sum(picks) % 2 == 1))
+    del starts, ends, coords
+
+    def count(label):
+        np.equal(padded, label, out=counts)
+        for axis in br.AXES:
+            np.cumsum(counts, axis=axis, dtype=count_type, out=counts)
+        flat = table.ravel()
+        total = np.zeros(len(radii), dtype=count_type)
+        for index, adds in corners:
+            if adds:
+                total += flat[index]
+            else:
+                total -= flat[index]
+        return total
+    return count
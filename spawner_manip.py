@@ -12,7 +12,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 3)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -731,7 +731,7 @@ def op_find(level, box, options):
     positions = []
 
     # Go through all the spawners.
-    for teid, pos, te in br.iterate(level, box, br.TES):
+    for teid, pos, te in br.iterate(level, box, br.TES, readonly=True):
         if teid not in SPAWNER_TEID: # Ignore non-spawners.
             continue
 
@@ -774,7 +774,7 @@ def op_find(level, box, options):
 def op_list(level, box, options):
     # Go through all the spawners.
     count = 0
-    for teid, _, te in br.iterate(level, box, br.TES):
+    for teid, _, te in br.iterate(level, box, br.TES, readonly=True):
         if teid not in SPAWNER_TEID: # Ignore non-spawners.
             continue
         # Count and print.
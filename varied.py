@@ -8,7 +8,7 @@ except ImportError:
             "filter folder? It can be downloaded from: "
             "github.com/FrostyAceHook/br-filters")
 try:
-    br.require_version(2, 1)
+    br.require_version(2, 4)
 except AttributeError:
     raise ImportError("Outdated version of 'br.py'. Please download the latest "
             "compatible version from: github.com/FrostyAceHook/br-filters")
@@ -53,7 +53,9 @@ def perform(level, box, options):
     # Iterate through the chunks, find the blocks to replace, get the proportions
     # and set them blocks. This can be holey cause skipping any missing chunks is
     # okie dokie.
-    for ids, datas, _ in br.iterate(level, box, br.BLOCKS, holey=True):
+    changes = br.Changes()
+    for ids, datas, _ in br.iterate(level, box, br.BLOCKS, holey=True,
+            changes=changes):
         # Get the replacement mask.
         mask = replace.matches(ids, datas)
 
@@ -87,4 +89,5 @@ def perform(level, box, options):
         else:
             print "- block {}: unchanged".format(i + 1)
         print "- block {} weight: {}".format(i + 1, bweight)
+    print "- changed: {}".format(changes)
     return